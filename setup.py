@@ -15,7 +15,7 @@ def read(*parts):
 
 
 def find_version(*file_paths):
-    """Return version number from main module"""
+    """Return version number from version module"""
     version_file = read(*file_paths)
     version_match = re.search(r"^__version__ = ['\"]([^'\"]*)['\"]", version_file, re.M)
     if version_match:
@@ -33,7 +33,7 @@ PYTHON_REQUIRES = '>=3.2'
 
 setup(name='tapeimgr',
       packages=find_packages(),
-      version=find_version('tapeimgr', 'tapeimgr.py'),
+      version=find_version('tapeimgr', 'version.py'),
       license='Apache License 2.0',
       install_requires=INSTALL_REQUIRES,
       python_requires=PYTHON_REQUIRES,
@@ -46,13 +46,17 @@ setup(name='tapeimgr',
       maintainer_email='johan.vanderknijff@kb.nl',
       url='https://github.com/KBNLresearch/tapeimgr',
       download_url=('https://github.com/KBNLresearch/tapeimgr/archive/' +
-                    find_version('tapeimgr', 'tapeimgr.py') + '.tar.gz'),
+                    find_version('tapeimgr', 'version.py') + '.tar.gz'),
       package_data={'tapeimgr': ['*.*', 'icons/*', 'pkexec/*']},
       zip_safe=False,
       entry_points={'gui_scripts': [
           'tapeimgr = tapeimgr.tapeimgr:main'],
                     'console_scripts': [
                         'tapeimgr = tapeimgr.tapeimgr:main',
+                        'tapeimgr-batch = tapeimgr.batch:main',
+                        'tapeimgr-queue = tapeimgr.changer:main',
+                        'tapeimgr-benchmark = tapeimgr.benchmark:main',
+                        'tapeimgr-export = tapeimgr.export:main',
                         'tapeimgr-config = tapeimgr.configure:main']},
       classifiers=[
           'Programming Language :: Python :: 3',]
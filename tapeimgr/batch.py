@@ -0,0 +1,192 @@
+#! /usr/bin/env python3
+"""
+Tapeimgr, automated reading of tape
+Batch runner: images tapes in several drives at the same time
+
+Author: Johan van der Knijff
+Research department,  KB / National Library of the Netherlands
+"""
+
+import io
+import sys
+import json
+import logging
+import argparse
+import threading
+import uuid
+from .tape import Tape
+from .version import __version__
+from . import config
+from .shared import ThreadFilter
+from .cli import errorExit, printInfo, printWarning
+
+
+class Job:
+    """One tape, to be imaged in one drive"""
+
+    def __init__(self, jobName, jobDict, writeLimiter, hashLimiter):
+        """initialise Job class instance"""
+        self.jobName = jobName
+        self.tape = Tape()
+        self.tape.getConfiguration()
+        self.tape.writeLimiter = writeLimiter
+        self.tape.hashLimiter = hashLimiter
+        self.handler = None
+        self.thread = None
+
+        # Job items override the defaults from the configuration file
+        self.tape.dirOut = jobDict['dirOut']
+        self.tape.tapeDevice = jobDict.get('device', self.tape.tapeDevice)
+        self.tape.initBlockSize = jobDict.get('blockSize', self.tape.initBlockSize)
+        self.tape.files = jobDict.get('files', self.tape.files)
+        self.tape.prefix = jobDict.get('prefix', self.tape.prefix)
+        self.tape.extension = jobDict.get('extension', self.tape.extension)
+        self.tape.fillBlocks = jobDict.get('fillBlocks', self.tape.fillBlocks)
+        self.tape.identifier = jobDict.get('identifier', '')
+        if self.tape.identifier == '@uuid':
+            self.tape.identifier = str(uuid.uuid1())
+        self.tape.description = jobDict.get('description', '')
+        self.tape.notes = jobDict.get('notes', '')
+
+    def validate(self):
+        """Validate job input, returns list of error messages"""
+        self.tape.validateInput()
+        errors = []
+        if not self.tape.dirOutIsDirectory:
+            errors.append("output directory '" + self.tape.dirOut + "' doesn't exist")
+        elif not self.tape.dirOutIsWritable:
+            errors.append("cannot write to directory '" + self.tape.dirOut + "'")
+        elif self.tape.outputExistsFlag:
+            errors.append("directory '" + self.tape.dirOut + "' already contains output files")
+        if not self.tape.deviceAccessibleFlag:
+            errors.append('tape device ' + self.tape.tapeDevice + ' is not accessible')
+        if not self.tape.blockSizeIsValid:
+            errors.append("block size '" + str(self.tape.initBlockSize) + "' not valid")
+        if not self.tape.filesIsValid:
+            errors.append("files value '" + self.tape.files + "' not valid")
+        errors += self.tape.settingsErrors()
+        return errors
+
+    def start(self):
+        """Attach this job's log file handler, and start processing the tape
+        in a separate thread"""
+        self.handler = logging.FileHandler(self.tape.logFile)
+        self.handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+        self.handler.addFilter(ThreadFilter(self.jobName))
+        logging.getLogger().addHandler(self.handler)
+        self.thread = threading.Thread(target=self.run, name=self.jobName)
+        self.thread.start()
+
+    def run(self):
+        """Process the tape; an unexpected error is written to the job's log
+        file, and marks the job as failed"""
+        try:
+            self.tape.processTape()
+        except Exception:
+            logging.exception('unexpected error while processing tape')
+            self.tape.successFlag = False
+
+    def finish(self):
+        """Wait for job to finish, and detach its log file handler"""
+        self.thread.join()
+        logging.getLogger().removeHandler(self.handler)
+        self.handler.close()
+
+
+def parseCommandLine(parser):
+    """Parse command line"""
+
+    parser.add_argument('jobFile',
+                        action='store',
+                        type=str,
+                        help='JSON file with list of jobs (one for each tape device)')
+    parser.add_argument('--version', '-v',
+                        action='version',
+                        version=__version__)
+    parser.add_argument('--writers', '-w',
+                        action='store',
+                        type=int,
+                        dest='writers',
+                        default=0,
+                        help='maximum number of concurrent disk writers (0 = no limit)')
+    parser.add_argument('--hashers', '-x',
+                        action='store',
+                        type=int,
+                        dest='hashers',
+                        default=0,
+                        help='maximum number of concurrent hashing workers (0 = no limit)')
+    # Parse arguments
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    """Main batch application"""
+
+    config.version = __version__
+    parser = argparse.ArgumentParser(description='Read contents of several tapes at the same '
+                                     'time, using one tape device for each tape')
+    args = parseCommandLine(parser)
+
+    try:
+        with io.open(args.jobFile, 'r', encoding='utf-8') as f:
+            jobList = json.load(f)
+    except (IOError, ValueError) as e:
+        errorExit('cannot read job file ' + args.jobFile + ': ' + str(e))
+
+    writeLimiter = None
+    if args.writers > 0:
+        writeLimiter = threading.BoundedSemaphore(args.writers)
+    hashLimiter = None
+    if args.hashers > 0:
+        hashLimiter = threading.BoundedSemaphore(args.hashers)
+
+    # Create and validate all jobs before anything is started
+    jobs = []
+    devices = set()
+    for i, jobDict in enumerate(jobList):
+        jobName = 'job' + str(i + 1)
+        try:
+            job = Job(jobName, jobDict, writeLimiter, hashLimiter)
+        except KeyError:
+            errorExit(jobName + ': no dirOut defined')
+        if not job.tape.configSuccess:
+            errorExit("Error reading configuration file! \n" +
+                      "Run '(sudo) tapeimgr-config' to fix this.")
+        errors = job.validate()
+        if job.tape.tapeDevice in devices:
+            errors.append('tape device ' + job.tape.tapeDevice + ' is used by another job')
+        devices.add(job.tape.tapeDevice)
+        if errors:
+            errorExit(jobName + ': ' + ', '.join(errors))
+        jobs.append(job)
+
+    # Log records of all jobs go to the console, each job also gets its own log file
+    rootLogger = logging.getLogger()
+    rootLogger.setLevel(logging.INFO)
+    consoleHandler = logging.StreamHandler(sys.stdout)
+    consoleHandler.setFormatter(logging.Formatter('%(threadName)s - %(levelname)s - %(message)s'))
+    rootLogger.addHandler(consoleHandler)
+
+    for job in jobs:
+        printInfo(job.jobName + ': reading ' + job.tape.tapeDevice + ' to ' + job.tape.dirOut)
+        job.start()
+
+    failedJobs = []
+    for job in jobs:
+        job.finish()
+        # A job that didn't finish (e.g. because of an unexpected error) failed
+        if not job.tape.successFlag or not job.tape.finishedFlag:
+            failedJobs.append(job.jobName)
+
+    if failedJobs:
+        printWarning('errors occurred in ' + ', '.join(failedJobs) +
+                     ', check log files for details')
+        sys.exit(1)
+
+    printInfo('all tapes processed successfully without errors!')
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
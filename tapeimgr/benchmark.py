@@ -0,0 +1,240 @@
+#! /usr/bin/env python3
+"""
+Tapeimgr, automated reading of tape
+Benchmark: images synthetic virtual tapes end to end, and reports
+throughput and resource use in JSON format
+
+Author: Johan van der Knijff
+Research department,  KB / National Library of the Netherlands
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import logging
+import platform
+import argparse
+import resource
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from .tape import Tape
+from .version import __version__
+from .virtualtape import VirtualBackend, VIRTUAL_PREFIX
+from . import config
+
+
+def smallFiles(scale):
+    """Many small files of a few records each"""
+    noFiles = max(int(200 * scale), 1)
+    return {'files': [{'records': [{'size': 10240, 'count': 4}]}] * noFiles}
+
+
+def largeFiles(scale):
+    """A few large files (64 MiB each at scale 1)"""
+    noRecords = max(int(256 * scale), 1)
+    return {'files': [{'records': [{'size': 262144, 'count': noRecords}]}] * 3}
+
+
+def mixedRecords(scale):
+    """Files with different record sizes, including a file that mixes
+    record sizes"""
+    noRecords = max(int(64 * scale), 1)
+    files = []
+    for size in [512, 10240, 32768, 65536, 1048576]:
+        files.append({'records': [{'size': size, 'count': noRecords}]})
+    files.append({'records': [{'size': 65536, 'count': noRecords},
+                              {'size': 4096, 'count': 1, 'pattern': 'zero'}]})
+    files.append({'records': [{'size': 10240, 'count': noRecords}]})
+    return {'files': files}
+
+
+def blockSizeProbing(scale):
+    """Same tape as mixedRecords, with block sizes established by probing
+    instead of a variable block mode read"""
+    return mixedRecords(scale)
+
+
+def badBlocks(scale):
+    """Files with unreadable records, read with fillBlocks"""
+    noRecords = max(int(256 * scale), 8)
+    files = [{'records': [{'size': 65536, 'count': noRecords}]}] * 4
+    errors = [{'file': 1, 'record': 2, 'count': 1, 'failures': -1},
+              {'file': 3, 'record': noRecords // 2, 'count': 4, 'failures': -1},
+              {'file': 4, 'record': noRecords, 'count': 1, 'failures': 1}]
+    return {'files': files, 'errors': errors}
+
+
+# Scenario name: (function that returns tape description, Tape attributes)
+SCENARIOS = {
+    'smallFiles': (smallFiles, {}),
+    'largeFiles': (largeFiles, {}),
+    'mixedRecords': (mixedRecords, {}),
+    'blockSizeProbing': (blockSizeProbing, {'variableBlockMode': False}),
+    'badBlocks': (badBlocks, {'fillBlocks': True}),
+}
+
+
+def runScenario(name, scale, workDir):
+    """Image the virtual tape of scenario name, and return dictionary with
+    results. Each scenario runs in its own process, so that peak RSS and
+    subprocess counts aren't affected by other scenarios"""
+
+    descriptionFunction, settings = SCENARIOS[name]
+    scenarioDir = os.path.join(workDir, name)
+    dirOut = os.path.join(scenarioDir, 'out')
+    os.makedirs(dirOut)
+    descriptionFile = os.path.join(scenarioDir, 'tape.json')
+    with io.open(descriptionFile, 'w', encoding='utf-8') as f:
+        json.dump(descriptionFunction(scale), f)
+
+    config.version = __version__
+    tape = Tape()
+    tape.dirOut = dirOut
+    tape.tapeDevice = VIRTUAL_PREFIX + descriptionFile
+    tape.deviceBackend = VirtualBackend(descriptionFile)
+    tape.initBlockSize = 512
+    tape.prefix = 'file'
+    tape.extension = 'dd'
+    tape.fillBlocks = False
+    tape.logFileName = 'tapeimgr.log'
+    tape.checksumFileName = 'checksums.sha512'
+    tape.metadataFileName = 'metadata.json'
+    tape.timeZone = 'UTC'
+    for attribute, value in settings.items():
+        setattr(tape, attribute, value)
+    tape.validateInput()
+
+    handler = logging.FileHandler(tape.logFile)
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    rootLogger = logging.getLogger()
+    rootLogger.setLevel(logging.INFO)
+    rootLogger.addHandler(handler)
+
+    tape.processTape()
+
+    rootLogger.removeHandler(handler)
+    handler.close()
+
+    bytesOut = sum(os.path.getsize(os.path.join(dirOut, fName))
+                   for fName in tape.checksums if os.path.isfile(os.path.join(dirOut, fName)))
+    wallTime = tape.phaseTimes.get('total', 0.0)
+    throughput = 0.0
+    if wallTime > 0:
+        throughput = bytesOut / wallTime / 1e6
+
+    results = {}
+    results['files'] = len(tape.checksums)
+    results['bytes'] = bytesOut
+    results['wallTime'] = wallTime
+    results['throughputMBs'] = throughput
+    results['phaseTimes'] = tape.phaseTimes
+    results['subProcesses'] = tape.subProcessCount
+    # ru_maxrss is in kilobytes on Linux
+    results['peakRSSKiB'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results['repositionings'] = tape.deviceBackend.positionOperations
+    results['readCalls'] = tape.deviceBackend.readCalls
+    results['successFlag'] = tape.successFlag
+    return results
+
+
+def parseCommandLine(parser):
+    """Parse command line"""
+
+    parser.add_argument('--version', '-v',
+                        action='version',
+                        version=__version__)
+    parser.add_argument('--scenarios', '-s',
+                        action='store',
+                        type=str,
+                        dest='scenarios',
+                        default=','.join(SCENARIOS),
+                        help='comma-separated list of scenarios to run (default: all)')
+    parser.add_argument('--scale', '-c',
+                        action='store',
+                        type=float,
+                        dest='scale',
+                        default=1.0,
+                        help='scale factor for the size of the synthetic tapes')
+    parser.add_argument('--repeat', '-r',
+                        action='store',
+                        type=int,
+                        dest='repeat',
+                        default=1,
+                        help='number of runs of each scenario')
+    parser.add_argument('--workdir', '-w',
+                        action='store',
+                        type=str,
+                        dest='workDir',
+                        default='',
+                        help='directory for output files (default: temporary directory)')
+    parser.add_argument('--output', '-o',
+                        action='store',
+                        type=str,
+                        dest='output',
+                        default='',
+                        help='write results to this file instead of standard output')
+    parser.add_argument('--keep', '-k',
+                        action='store_true',
+                        dest='keep',
+                        default=False,
+                        help='keep output files')
+    # Parse arguments
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    """Main benchmark application"""
+
+    parser = argparse.ArgumentParser(description='Image synthetic virtual tapes, and '
+                                     'report throughput and resource use')
+    args = parseCommandLine(parser)
+
+    scenarios = [s.strip() for s in args.scenarios.split(',')]
+    for name in scenarios:
+        if name not in SCENARIOS:
+            sys.stderr.write('unknown scenario ' + name + ', choose from ' +
+                             ', '.join(SCENARIOS) + '\n')
+            sys.exit(1)
+
+    if args.workDir:
+        workDir = tempfile.mkdtemp(dir=args.workDir)
+    else:
+        workDir = tempfile.mkdtemp(prefix='tapeimgr-benchmark-')
+
+    report = {}
+    report['tapeimgrVersion'] = __version__
+    report['pythonVersion'] = platform.python_version()
+    report['platform'] = platform.platform()
+    report['date'] = time.strftime('%Y-%m-%dT%H:%M:%S%z')
+    report['scale'] = args.scale
+    report['scenarios'] = {}
+
+    try:
+        for name in scenarios:
+            runs = []
+            for run in range(args.repeat):
+                runDir = os.path.join(workDir, 'run' + str(run + 1))
+                # New process for each run
+                with ProcessPoolExecutor(max_workers=1) as executor:
+                    runs.append(executor.submit(runScenario, name, args.scale, runDir).result())
+                sys.stderr.write(name + ' run ' + str(run + 1) + ': ' +
+                                 '{:.1f}'.format(runs[-1]['throughputMBs']) + ' MB/s\n')
+            report['scenarios'][name] = runs
+    finally:
+        if not args.keep:
+            shutil.rmtree(workDir, ignore_errors=True)
+
+    if args.output:
+        with io.open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=4, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=4, sort_keys=True)
+        sys.stdout.write('\n')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,333 @@
+#! /usr/bin/env python3
+"""
+Tapeimgr, automated reading of tape
+Queue mode: images a series of tapes that are loaded by a media changer
+
+Author: Johan van der Knijff
+Research department,  KB / National Library of the Netherlands
+"""
+
+import os
+import re
+import sys
+import time
+import logging
+import argparse
+import threading
+from .tape import Tape
+from .version import __version__
+from . import config
+from . import shared
+from .mtio import TapeDevice
+from .cli import errorExit, printInfo, printWarning
+
+
+class MtxChanger:
+    """Media changer that is controlled with the mtx tool"""
+
+    def __init__(self, changerDevice):
+        """initialise MtxChanger class instance"""
+        self.changerDevice = changerDevice
+
+    def load(self, slot, drive):
+        """Load tape from slot into drive, returns True on success"""
+        args = ['mtx', '-f', self.changerDevice, 'load', str(slot), str(drive)]
+        mtxStatus, mtxOut, mtxErr = shared.launchSubProcess(args)
+        return mtxStatus == 0
+
+    def unload(self, slot, drive):
+        """Unload tape from drive into slot, returns True on success"""
+        args = ['mtx', '-f', self.changerDevice, 'unload', str(slot), str(drive)]
+        mtxStatus, mtxOut, mtxErr = shared.launchSubProcess(args)
+        return mtxStatus == 0
+
+    def inventory(self):
+        """Return dictionary with barcodes as keys and slot numbers as values"""
+        args = ['mtx', '-f', self.changerDevice, 'status']
+        mtxStatus, mtxOut, mtxErr = shared.launchSubProcess(args, False)
+        barcodes = {}
+        for match in re.finditer(r'Storage Element (\d+)(?: IMPORT/EXPORT)?:Full'
+                                 r'\s*:VolumeTag\s*=\s*(\S+)', mtxOut):
+            barcodes[match.group(2)] = int(match.group(1))
+        return barcodes
+
+
+class SimulatedChanger:
+    """Media changer that loads simulated tapes into a SimulatedBackend. Tapes
+    is a dictionary with slot numbers as keys, and (barcode, files) tuples
+    as values, where files is in the format expected by SimulatedBackend"""
+
+    def __init__(self, tapes, driveBackend):
+        """initialise SimulatedChanger class instance"""
+        self.tapes = tapes
+        self.driveBackend = driveBackend
+        # Drive is empty initially
+        self.driveBackend.unloadTape()
+
+    def load(self, slot, drive):
+        """Load tape from slot into drive, returns True on success"""
+        if slot not in self.tapes or self.driveBackend.loaded:
+            return False
+        self.driveBackend.loadTape(self.tapes[slot][1])
+        return True
+
+    def unload(self, slot, drive):
+        """Unload tape from drive into slot, returns True on success"""
+        self.driveBackend.unloadTape()
+        return True
+
+    def inventory(self):
+        """Return dictionary with barcodes as keys and slot numbers as values"""
+        return {barcode: slot for slot, (barcode, files) in self.tapes.items()}
+
+
+class TapeQueue:
+    """Images a list of tapes from a media changer, one after another. Each
+    tape is written to its own subdirectory of dirOut. The unloading of
+    each tape and the loading of the next one run in a separate thread,
+    while the checksum and metadata files of the previous tape are written"""
+
+    def __init__(self, changer, drive, tapeDevice, dirOut, deviceBackend=None,
+                 loadTimeout=300):
+        """initialise TapeQueue class instance"""
+        self.changer = changer
+        self.drive = drive
+        self.tapeDevice = tapeDevice
+        self.dirOut = dirOut
+        self.deviceBackend = deviceBackend
+        self.loadTimeout = loadTimeout
+        self.loadedSlot = None
+        # Tape attributes that are set for each tape (e.g. fillBlocks, prefix)
+        self.tapeSettings = {}
+
+    def swapTapes(self, unloadSlot, loadSlot):
+        """Unload tape from unloadSlot, then load tape from loadSlot (either can
+        be None)"""
+        if unloadSlot is not None:
+            logging.info('*** Unloading tape into slot ' + str(unloadSlot) + ' ***')
+            if not self.changer.unload(unloadSlot, self.drive):
+                logging.error('cannot unload tape into slot ' + str(unloadSlot))
+        self.loadedSlot = None
+        if loadSlot is not None:
+            logging.info('*** Loading tape from slot ' + str(loadSlot) + ' ***')
+            if self.changer.load(loadSlot, self.drive) and self.waitReady():
+                self.loadedSlot = loadSlot
+            else:
+                logging.error('cannot load tape from slot ' + str(loadSlot))
+
+    def waitReady(self):
+        """Wait until the drive reports that a tape is loaded, returns True
+        on success, False on timeout"""
+        timeEnd = time.time() + self.loadTimeout
+        while True:
+            device = TapeDevice(self.tapeDevice, self.deviceBackend)
+            tapeStatus = device.status()
+            device.close()
+            if tapeStatus is not None and tapeStatus.online:
+                return True
+            if time.time() > timeEnd:
+                return False
+            time.sleep(1)
+
+    def createTape(self, name):
+        """Create and validate Tape instance for tape name; returns Tape
+        instance and list of error messages"""
+        tape = Tape()
+        tape.getConfiguration()
+        for attribute, value in self.tapeSettings.items():
+            setattr(tape, attribute, value)
+        tape.tapeDevice = self.tapeDevice
+        tape.deviceBackend = self.deviceBackend
+        tape.identifier = name
+        tape.dirOut = os.path.join(self.dirOut, name)
+
+        errors = []
+        try:
+            os.makedirs(tape.dirOut, exist_ok=True)
+        except OSError as e:
+            errors.append('cannot create directory ' + tape.dirOut + ': ' + str(e))
+            return tape, errors
+
+        tape.validateInput()
+        if not tape.dirOutIsWritable:
+            errors.append("cannot write to directory '" + tape.dirOut + "'")
+        elif tape.outputExistsFlag:
+            errors.append("directory '" + tape.dirOut + "' already contains output files")
+        if not tape.deviceAccessibleFlag:
+            errors.append('tape device ' + tape.tapeDevice + ' is not accessible')
+        if not tape.blockSizeIsValid:
+            errors.append("block size '" + str(tape.initBlockSize) + "' not valid")
+        if not tape.filesIsValid:
+            errors.append("files value '" + tape.files + "' not valid")
+        errors += tape.settingsErrors()
+        return tape, errors
+
+    def run(self, queue):
+        """Process queue, which is a list of (slot, name) tuples. Returns
+        dictionary with names as keys and success flags as values"""
+
+        results = {}
+        if not queue:
+            return results
+
+        self.swapTapes(None, queue[0][0])
+
+        for i, (slot, name) in enumerate(queue):
+            nextSlot = None
+            if i + 1 < len(queue):
+                nextSlot = queue[i + 1][0]
+
+            if self.loadedSlot != slot:
+                # Loading failed, so there is nothing to unload
+                results[name] = False
+                self.swapTapes(None, nextSlot)
+                continue
+
+            tape, errors = self.createTape(name)
+            handler = None
+            if errors:
+                logging.error(name + ': ' + ', '.join(errors))
+                tape.successFlag = False
+                device = TapeDevice(self.tapeDevice, self.deviceBackend)
+                device.eject()
+                device.close()
+            else:
+                # Log file of this tape gets records of this thread and its helpers
+                handler = logging.FileHandler(tape.logFile)
+                handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+                handler.addFilter(shared.ThreadFilter(threading.current_thread().name))
+                logging.getLogger().addHandler(handler)
+                logging.info('*** Processing tape ' + name + ' from slot ' + str(slot) + ' ***')
+                if tape.extractTape():
+                    tape.ejectTape()
+                else:
+                    errors.append('tape device not accessible')
+
+            # Swap tapes while the checksum and metadata files are written
+            changerThread = threading.Thread(target=self.swapTapes,
+                                             args=(slot, nextSlot),
+                                             name='changer')
+            changerThread.start()
+
+            if not errors:
+                tape.finishTape()
+            if handler is not None:
+                logging.getLogger().removeHandler(handler)
+                handler.close()
+
+            results[name] = tape.successFlag
+            changerThread.join()
+
+        return results
+
+
+def parseCommandLine(parser):
+    """Parse command line"""
+
+    parser.add_argument('changer',
+                        action='store',
+                        type=str,
+                        help='media changer device (e.g. /dev/sg1)')
+    parser.add_argument('dirOut',
+                        action='store',
+                        type=str,
+                        help='output directory; each tape is written to a subdirectory')
+    parser.add_argument('--version', '-v',
+                        action='version',
+                        version=__version__)
+    parser.add_argument('--slots', '-l',
+                        action='store',
+                        type=str,
+                        dest='slots',
+                        default='',
+                        help='comma-separated list of slots to process')
+    parser.add_argument('--barcodes', '-b',
+                        action='store',
+                        type=str,
+                        dest='barcodes',
+                        default='',
+                        help='comma-separated list of barcodes to process')
+    parser.add_argument('--device', '-d',
+                        action='store',
+                        type=str,
+                        dest='device',
+                        default='',
+                        help='non-rewind tape device')
+    parser.add_argument('--drive', '-r',
+                        action='store',
+                        type=int,
+                        dest='drive',
+                        default=0,
+                        help='number of the changer drive that holds the tape device')
+    parser.add_argument('--fill', '-f',
+                        action='store_true',
+                        dest='fillBlocks',
+                        default=False,
+                        help='fill blocks that give read errors with null bytes')
+    # Parse arguments
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    """Main queue application"""
+
+    config.version = __version__
+    parser = argparse.ArgumentParser(description='Read contents of a series of tapes '
+                                     'that are loaded by a media changer')
+    args = parseCommandLine(parser)
+
+    # Default tape device from configuration file
+    tape = Tape()
+    tape.getConfiguration()
+    if not tape.configSuccess:
+        errorExit("Error reading configuration file! \n" +
+                  "Run '(sudo) tapeimgr-config' to fix this.")
+    tapeDevice = args.device or tape.tapeDevice
+
+    if not os.path.isdir(args.dirOut):
+        errorExit("Output directory '" + args.dirOut + "' doesn't exist!")
+
+    changer = MtxChanger(args.changer)
+
+    # Queue of (slot, name) tuples
+    queue = []
+    if args.barcodes:
+        inventory = changer.inventory()
+        for barcode in args.barcodes.split(','):
+            barcode = barcode.strip()
+            if barcode not in inventory:
+                errorExit('barcode ' + barcode + ' not found in changer')
+            queue.append((inventory[barcode], barcode))
+    elif args.slots:
+        try:
+            for slot in args.slots.split(','):
+                queue.append((int(slot), 'slot' + slot.strip().zfill(3)))
+        except ValueError:
+            errorExit('--slots value not valid, must be a comma-delimited\n'
+                      '    string of integer numbers')
+    else:
+        errorExit('either --slots or --barcodes must be given')
+
+    rootLogger = logging.getLogger()
+    rootLogger.setLevel(logging.INFO)
+    consoleHandler = logging.StreamHandler(sys.stdout)
+    consoleHandler.setFormatter(logging.Formatter('%(levelname)s - %(message)s'))
+    rootLogger.addHandler(consoleHandler)
+
+    tapeQueue = TapeQueue(changer, args.drive, tapeDevice, args.dirOut)
+    tapeQueue.tapeSettings['fillBlocks'] = args.fillBlocks
+    results = tapeQueue.run(queue)
+
+    failedTapes = [name for name in results if not results[name]]
+    if failedTapes:
+        printWarning('errors occurred for tapes ' + ', '.join(failedTapes) +
+                     ', check log files for details')
+        sys.exit(1)
+
+    printInfo('all tapes processed successfully without errors!')
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+#! /usr/bin/env python3
+"""This module contains the ChunkStore class, a content-addressed store that
+holds each unique chunk of data only once, and the ChunkWriter and
+ManifestReader classes, which split an extracted file into chunks and put
+them together again.
+
+Chunks are stored under their SHA-256 hash (as a hexadecimal string), in
+a subdirectory named after its first two characters:
+
+    store/3f/3fa5...e1
+
+Instead of the extracted file, a manifest is written (e.g.
+file000001.dd.manifest). This is a small JSON file that lists the chunks of
+the file, in order:
+
+    {
+        "chunkSize": 4194304,
+        "chunks": [["3fa5...e1", 4194304], ["09bc...7d", 1210368]],
+        "hashType": "SHA-256",
+        "size": 5404672,
+        "store": "/data/chunkstore"
+    }
+
+Files are split into chunks of a fixed size, so data that recur at the same
+chunk offsets (e.g. identical files, or unchanged parts of successive
+backup generations) are stored only once.
+"""
+
+import os
+import io
+import json
+import hashlib
+import threading
+
+# Default size (in bytes) of the chunks
+CHUNK_SIZE = 2**22
+
+# Extension of manifest files
+MANIFEST_EXTENSION = 'manifest'
+
+
+class ChunkStore:
+    """ChunkStore class"""
+
+    def __init__(self, directory):
+        """initialise ChunkStore class instance"""
+        self.directory = os.path.abspath(directory)
+
+    def chunkPath(self, key):
+        """Return path of chunk with hash key"""
+        return os.path.join(self.directory, key[:2], key)
+
+    def put(self, key, data):
+        """Store data under hash key, unless the store has it already. The
+        chunk is flushed to disk before it appears in the store, so the
+        store never contains incomplete chunks. Returns True if the chunk
+        was new"""
+        path = self.chunkPath(key)
+        if os.path.exists(path):
+            return False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Unique temporary name, as other processes may store the same chunk
+        tempPath = (path + '.' + str(os.getpid()) + '-' + str(threading.get_ident()) +
+                    '.tmp')
+        with io.open(tempPath, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tempPath, path)
+        return True
+
+    def open(self, key):
+        """Return binary file object for reading chunk with hash key"""
+        return io.open(self.chunkPath(key), 'rb', buffering=0)
+
+
+class ChunkWriter:
+    """Binary file-like object that splits the data written to it into
+    chunks, puts them in store (a ChunkStore instance), and writes a
+    manifest to manifestFile when it is closed"""
+
+    def __init__(self, store, manifestFile, chunkSize=CHUNK_SIZE):
+        """initialise ChunkWriter class instance"""
+        self.store = store
+        self.manifestFile = manifestFile
+        self.chunkSize = chunkSize
+        self.chunk = bytearray()
+        # List of [key, size] lists
+        self.chunks = []
+        self.size = 0
+        # Number of chunks that were new to the store, and their size
+        self.newChunks = 0
+        self.bytesStored = 0
+
+    def write(self, data):
+        """Add data; returns the number of bytes"""
+        noBytes = len(data)
+        self.size += noBytes
+        with memoryview(data) as view:
+            while view:
+                free = self.chunkSize - len(self.chunk)
+                self.chunk += view[:free]
+                view = view[free:]
+                if len(self.chunk) == self.chunkSize:
+                    self.storeChunk()
+        return noBytes
+
+    def storeChunk(self):
+        """Put current chunk in the store, and add it to the manifest"""
+        key = hashlib.sha256(self.chunk).hexdigest()
+        if self.store.put(key, self.chunk):
+            self.newChunks += 1
+            self.bytesStored += len(self.chunk)
+        self.chunks.append([key, len(self.chunk)])
+        self.chunk = bytearray()
+
+    def close(self):
+        """Store remaining data, and write manifest"""
+        if self.chunk:
+            self.storeChunk()
+        manifest = {}
+        manifest['store'] = self.store.directory
+        manifest['hashType'] = 'SHA-256'
+        manifest['chunkSize'] = self.chunkSize
+        manifest['size'] = self.size
+        manifest['chunks'] = self.chunks
+        tempFile = self.manifestFile + '.tmp'
+        with io.open(tempFile, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=4, sort_keys=True)
+        os.replace(tempFile, self.manifestFile)
+
+
+def readManifest(manifestFile):
+    """Read manifest, and return it as a dictionary. Raises OSError or
+    ValueError if it cannot be read"""
+    with io.open(manifestFile, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    for key in ['store', 'chunks', 'size']:
+        if key not in manifest:
+            raise ValueError('manifest ' + manifestFile + ' has no ' + key)
+    return manifest
+
+
+class ManifestReader(io.RawIOBase):
+    """Binary file object that reads the file described by a manifest from
+    its chunk store. The store of the manifest is used unless store (a
+    ChunkStore instance) is given"""
+
+    def __init__(self, manifestFile, store=None):
+        """initialise ManifestReader class instance"""
+        super().__init__()
+        self.manifest = readManifest(manifestFile)
+        self.store = store or ChunkStore(self.manifest['store'])
+        self.chunkIndex = 0
+        self.chunkFile = None
+
+    def readable(self):
+        """File can be read"""
+        return True
+
+    def readinto(self, b):
+        """Read up to len(b) bytes into b, returns number of bytes read (0 at
+        end of file)"""
+        while self.chunkIndex < len(self.manifest['chunks']):
+            if self.chunkFile is None:
+                key = self.manifest['chunks'][self.chunkIndex][0]
+                self.chunkFile = self.store.open(key)
+            noBytes = self.chunkFile.readinto(b)
+            if noBytes:
+                return noBytes
+            self.chunkFile.close()
+            self.chunkFile = None
+            self.chunkIndex += 1
+        return 0
+
+    def close(self):
+        """Close current chunk"""
+        if self.chunkFile is not None:
+            self.chunkFile.close()
+            self.chunkFile = None
+        super().close()
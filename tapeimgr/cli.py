@@ -7,12 +7,14 @@ Author: Johan van der Knijff
 Research department,  KB / National Library of the Netherlands
 """
 
+import os
 import sys
 import logging
 import argparse
 import uuid
 from .tape import Tape
 from . import config
+from .compression import CODECS
 
 
 class tapeimgrCLI:
@@ -57,6 +59,24 @@ class tapeimgrCLI:
                                  dest='fillBlocks',
                                  default=self.tape.fillBlocks,
                                  help='fill blocks that give read errors with null bytes')
+        self.parser.add_argument('--retry', '-r',
+                                 action='store_true',
+                                 dest='retryMode',
+                                 default=False,
+                                 help='retry pass: read blocks that failed in an earlier '
+                                 'run again, using the mapfiles in dirOut')
+        self.parser.add_argument('--resume', '-u',
+                                 action='store_true',
+                                 dest='resume',
+                                 default=False,
+                                 help='resume interrupted run, using the journal in dirOut')
+        self.parser.add_argument('--compression', '-z',
+                                 action='store',
+                                 type=str,
+                                 choices=[''] + list(CODECS),
+                                 help='compress output files with this codec',
+                                 dest='compression',
+                                 default=self.tape.compression)
         self.parser.add_argument('--device', '-d',
                                  action='store',
                                  type=str,
@@ -72,7 +92,8 @@ class tapeimgrCLI:
         self.parser.add_argument('--files', '-s',
                                  action='store',
                                  type=str,
-                                 help='comma-separated list of files to extract',
+                                 help='comma-separated list of files or file ranges '
+                                 'to extract (e.g. 1-50,200-)',
                                  dest='files',
                                  default=self.tape.files)
         self.parser.add_argument('--prefix', '-p',
@@ -109,6 +130,9 @@ class tapeimgrCLI:
         args = self.parser.parse_args()
         self.tape.dirOut = args.dirOut
         self.tape.fillBlocks = args.fillBlocks
+        self.tape.retryMode = args.retryMode
+        self.tape.resume = args.resume
+        self.tape.compression = args.compression
         self.tape.tapeDevice = args.device
         self.tape.initBlockSize = args.size
         self.tape.files = args.files
@@ -158,11 +182,25 @@ class tapeimgrCLI:
 
         if not self.tape.filesIsValid:
             msg = ('--files value not valid, must be a comma-delimited\n'
-                   '    string of integer numbers, or empty!')
+                   '    string of integer numbers or ranges (e.g. 1-50,200-), or empty!')
+            errorExit(msg)
+
+        # Compression, chunk store and checksum algorithm settings
+        for msg in self.tape.settingsErrors():
+            errorExit(msg + '!')
+
+        if self.tape.resume and self.tape.retryMode:
+            msg = ('--resume and --retry cannot be used together!')
+            errorExit(msg)
+
+        if self.tape.resume and not os.path.isfile(self.tape.journalFile):
+            msg = ("No journal found in '" + self.tape.dirOut + "', cannot resume!")
             errorExit(msg)
 
-        # Ask confirmation if output files exist already
-        if self.tape.outputExistsFlag:
+        # Ask confirmation if output files exist already (a retry pass or
+        # resumed run only updates existing files)
+        if (self.tape.outputExistsFlag and not self.tape.retryMode and
+                not self.tape.resume):
             msg = ('WARNING: writing to ' + self.tape.dirOut + ' will overwrite existing files!\n'
                    'do you really want to proceed? (enter Y to proceed, or N to cancel): ')
             continueResponse = input(msg)
@@ -0,0 +1,210 @@
+#! /usr/bin/env python3
+"""This module contains the block compression codecs that can be used to
+compress extracted files on the fly, and the CompressedWriter class, which
+compresses the data that is written to it with a pool of worker threads.
+
+The data are split into chunks of CHUNK_SIZE bytes, and each chunk is
+compressed into a complete, independent stream (as done by pigz and
+pbzip2). The streams are written in order, and their concatenation is a
+valid gzip, bzip2 or xz file that can be read by the standard tools.
+Codecs from the standard library release the GIL while compressing, so
+the chunks are compressed in parallel.
+
+Other codecs can be added by subclassing Codec, and registering the
+subclass with registerCodec.
+"""
+
+import os
+import io
+import bz2
+import lzma
+import zlib
+import gzip
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+# Size (in bytes) of the chunks that are compressed independently
+CHUNK_SIZE = 2**20
+
+
+class Codec:
+    """Base class for compression codecs"""
+
+    # Codec name (as used in the configuration file), and file extension
+    name = ''
+    extension = ''
+    defaultLevel = 6
+    # Range of valid compression levels
+    minLevel = 1
+    maxLevel = 9
+
+    def __init__(self, level=None):
+        """initialise Codec instance; level is the compression level (None
+        for the codec's default level). Raises ValueError if level is out of
+        range"""
+        if level is None:
+            level = self.defaultLevel
+        if not self.minLevel <= level <= self.maxLevel:
+            raise ValueError('compression level of ' + self.name + ' must be between ' +
+                             str(self.minLevel) + ' and ' + str(self.maxLevel))
+        self.level = level
+
+    def compress(self, data):
+        """Return data compressed as a complete, independent stream"""
+        raise NotImplementedError
+
+    def open(self, fileName):
+        """Return binary file object that reads the decompressed contents
+        of fileName"""
+        raise NotImplementedError
+
+
+class GzipCodec(Codec):
+    """gzip codec"""
+    name = 'gzip'
+    extension = 'gz'
+    defaultLevel = 6
+
+    def compress(self, data):
+        """Return data compressed as a gzip member"""
+        # wbits 31 writes a gzip header with a zero time stamp, so the
+        # output only depends on the data
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, 31)
+        return compressor.compress(data) + compressor.flush()
+
+    def open(self, fileName):
+        """Return file object that reads decompressed fileName"""
+        return gzip.open(fileName, 'rb')
+
+
+class Bz2Codec(Codec):
+    """bzip2 codec"""
+    name = 'bz2'
+    extension = 'bz2'
+    defaultLevel = 9
+
+    def compress(self, data):
+        """Return data compressed as a bzip2 stream"""
+        return bz2.compress(data, self.level)
+
+    def open(self, fileName):
+        """Return file object that reads decompressed fileName"""
+        return bz2.open(fileName, 'rb')
+
+
+class XzCodec(Codec):
+    """xz codec"""
+    name = 'xz'
+    extension = 'xz'
+    defaultLevel = 6
+    minLevel = 0
+
+    def compress(self, data):
+        """Return data compressed as an xz stream"""
+        return lzma.compress(data, preset=self.level)
+
+    def open(self, fileName):
+        """Return file object that reads decompressed fileName"""
+        return lzma.open(fileName, 'rb')
+
+
+# Codec name: Codec subclass
+CODECS = collections.OrderedDict()
+
+
+def registerCodec(codecClass):
+    """Make codecClass (a subclass of Codec) available under its name"""
+    CODECS[codecClass.name] = codecClass
+
+
+for _codecClass in [GzipCodec, Bz2Codec, XzCodec]:
+    registerCodec(_codecClass)
+
+
+def getCodec(name, level=None):
+    """Return instance of codec name, or None if name is empty. Raises
+    KeyError if there is no codec with this name, and ValueError if level is
+    not valid for the codec"""
+    if not name:
+        return None
+    return CODECS[name](level)
+
+
+def codecForFile(fileName):
+    """Return instance of codec that matches the extension of fileName, or
+    None if fileName is not compressed"""
+    extension = os.path.splitext(fileName)[1][1:]
+    for codecClass in CODECS.values():
+        if codecClass.extension == extension:
+            return codecClass()
+    return None
+
+
+def stripExtension(fileName):
+    """Return fileName without the extension of its codec (if any)"""
+    if codecForFile(fileName) is None:
+        return fileName
+    return os.path.splitext(fileName)[0]
+
+
+def openFile(fileName):
+    """Open fileName for reading; compressed files are decompressed"""
+    codec = codecForFile(fileName)
+    if codec is None:
+        return io.open(fileName, 'rb', buffering=0)
+    return codec.open(fileName)
+
+
+class CompressedWriter:
+    """Binary file-like object that compresses the data written to it with
+    codec, using a pool of worker threads, and writes the result to fOut
+    (a binary file object, which is closed by close())"""
+
+    def __init__(self, fOut, codec, workers=0):
+        """initialise CompressedWriter class instance"""
+        if workers <= 0:
+            workers = os.cpu_count() or 1
+        self.fOut = fOut
+        self.codec = codec
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        # Chunks that are being compressed, in order; the writer waits for
+        # the oldest one if there are more than maxPending
+        self.pending = collections.deque()
+        self.maxPending = 2 * workers
+        self.chunk = bytearray()
+        # Number of bytes written to fOut
+        self.bytesOut = 0
+
+    def write(self, data):
+        """Compress data; returns the number of (uncompressed) bytes"""
+        self.chunk += data
+        if len(self.chunk) >= CHUNK_SIZE:
+            self.submitChunk()
+        return len(data)
+
+    def submitChunk(self):
+        """Queue current chunk for compression, and write any compressed
+        chunks that are done"""
+        self.pending.append(self.executor.submit(self.codec.compress, self.chunk))
+        self.chunk = bytearray()
+        while self.pending and (len(self.pending) > self.maxPending or
+                                self.pending[0].done()):
+            self.writeCompressed()
+
+    def writeCompressed(self):
+        """Wait for the oldest pending chunk, and write it to fOut"""
+        compressed = self.pending.popleft().result()
+        self.fOut.write(compressed)
+        self.bytesOut += len(compressed)
+
+    def close(self):
+        """Compress and write remaining data, and close fOut"""
+        try:
+            if self.chunk or (self.bytesOut == 0 and not self.pending):
+                # An empty file still gets an (empty) stream
+                self.submitChunk()
+            while self.pending:
+                self.writeCompressed()
+        finally:
+            self.executor.shutdown()
+            self.fOut.close()
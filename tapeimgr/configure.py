@@ -60,6 +60,23 @@ def writeConfigFile(configRootDir, removeFlag):
     configSettings['fillBlocks'] = 'False'
     configSettings['timeZone'] = 'Europe/Amsterdam'
     configSettings['defaultDir'] = ''
+    configSettings['readMethod'] = 'internal'
+    configSettings['readBufferSize'] = '1048576'
+    configSettings['bufferCount'] = '4'
+    configSettings['verifyChecksums'] = 'False'
+    configSettings['checksumWorkers'] = '0'
+    configSettings['variableBlockMode'] = 'True'
+    configSettings['maxBlockSize'] = '1048576'
+    configSettings['tapeCapacity'] = '0'
+    configSettings['logDisplayLines'] = '10000'
+    configSettings['journalFileName'] = 'journal.jsonl'
+    configSettings['compression'] = ''
+    configSettings['compressionLevel'] = ''
+    configSettings['compressionWorkers'] = '0'
+    configSettings['sparseFiles'] = 'True'
+    configSettings['chunkStore'] = ''
+    configSettings['chunkSize'] = '4194304'
+    configSettings['checksumAlgorithms'] = ''
 
     if not removeFlag:
         # Write to configuration file in json format
@@ -0,0 +1,154 @@
+#! /usr/bin/env python3
+"""
+Tapeimgr, automated reading of tape
+Export: reassembles files that were written to a chunk store to plain
+files, using their manifests
+
+Author: Johan van der Knijff
+Research department,  KB / National Library of the Netherlands
+"""
+
+import os
+import io
+import sys
+import time
+import shutil
+import hashlib
+import argparse
+from .version import __version__
+from .chunkstore import ChunkStore, readManifest, MANIFEST_EXTENSION
+
+
+def copyChunk(fIn, fOut, size):
+    """Copy size bytes from fIn to fOut. The data are copied inside the
+    kernel if possible (which may even share the blocks on file systems that
+    support this), and through a buffer otherwise"""
+    copied = 0
+    try:
+        while copied < size:
+            noBytes = os.copy_file_range(fIn.fileno(), fOut.fileno(), size - copied)
+            if not noBytes:
+                break
+            copied += noBytes
+        if copied == size:
+            return
+    except (AttributeError, OSError):
+        # Not available on this platform or file system, so fall back to a
+        # buffered copy of the rest of the chunk
+        fIn.seek(copied)
+        fOut.seek(0, io.SEEK_END)
+    shutil.copyfileobj(fIn, fOut)
+
+
+def exportFile(manifestFile, fileOut, store=None, verify=False):
+    """Reassemble file described by manifestFile to fileOut. If verify is
+    True, the hash of each chunk is checked. Returns number of bytes
+    written, or None if an error occurred"""
+
+    try:
+        manifest = readManifest(manifestFile)
+    except (OSError, ValueError) as e:
+        sys.stderr.write('ERROR: cannot read manifest ' + manifestFile + ': ' + str(e) + '\n')
+        return None
+    if store is None:
+        store = ChunkStore(manifest['store'])
+
+    try:
+        with io.open(fileOut, 'wb', buffering=0) as fOut:
+            for key, size in manifest['chunks']:
+                with store.open(key) as fIn:
+                    if verify:
+                        data = fIn.read()
+                        if len(data) != size or hashlib.sha256(data).hexdigest() != key:
+                            sys.stderr.write('ERROR: chunk ' + key + ' of ' + manifestFile +
+                                             ' is damaged\n')
+                            return None
+                        fOut.write(data)
+                    else:
+                        copyChunk(fIn, fOut, size)
+            noBytes = fOut.tell()
+    except OSError as e:
+        sys.stderr.write('ERROR: cannot export ' + manifestFile + ': ' + str(e) + '\n')
+        return None
+
+    if noBytes != manifest['size']:
+        sys.stderr.write('ERROR: size of ' + fileOut + ' (' + str(noBytes) +
+                         ') differs from manifest (' + str(manifest['size']) + ')\n')
+        return None
+    return noBytes
+
+
+def parseCommandLine(parser):
+    """Parse command line"""
+
+    parser.add_argument('manifests',
+                        action='store',
+                        type=str,
+                        nargs='+',
+                        help='manifest file(s)')
+    parser.add_argument('--version', '-v',
+                        action='version',
+                        version=__version__)
+    parser.add_argument('--output', '-o',
+                        action='store',
+                        type=str,
+                        dest='dirOut',
+                        default='',
+                        help='output directory (default: directory of each manifest)')
+    parser.add_argument('--store', '-s',
+                        action='store',
+                        type=str,
+                        dest='store',
+                        default='',
+                        help='chunk store directory (default: store recorded in manifest)')
+    parser.add_argument('--verify', '-c',
+                        action='store_true',
+                        dest='verify',
+                        default=False,
+                        help='check hash of each chunk')
+    # Parse arguments
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    """Main export application"""
+
+    parser = argparse.ArgumentParser(description='Reassemble files from a chunk store, '
+                                     'using their manifests')
+    args = parseCommandLine(parser)
+
+    store = None
+    if args.store:
+        store = ChunkStore(args.store)
+
+    success = True
+    totalBytes = 0
+    startTime = time.perf_counter()
+    for manifestFile in args.manifests:
+        fileOut = manifestFile
+        if fileOut.endswith('.' + MANIFEST_EXTENSION):
+            fileOut = fileOut[:-len(MANIFEST_EXTENSION) - 1]
+        else:
+            fileOut += '.dd'
+        if args.dirOut:
+            fileOut = os.path.join(args.dirOut, os.path.basename(fileOut))
+
+        noBytes = exportFile(manifestFile, fileOut, store, args.verify)
+        if noBytes is None:
+            success = False
+            continue
+        totalBytes += noBytes
+        sys.stderr.write('INFO: ' + manifestFile + ' -> ' + fileOut + '\n')
+
+    elapsedTime = time.perf_counter() - startTime
+    if elapsedTime > 0:
+        sys.stderr.write('INFO: exported ' + str(totalBytes) + ' bytes at ' +
+                         '{:.1f}'.format(totalBytes / elapsedTime / 1e6) + ' MB/s\n')
+
+    if not success:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
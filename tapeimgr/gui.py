@@ -14,6 +14,8 @@ import threading
 import logging
 import queue
 import uuid
+import datetime
+import collections
 from pathlib import Path
 import tkinter as tk
 from tkinter import filedialog as tkFileDialog
@@ -24,6 +26,10 @@ from tkfilebrowser import askopendirname
 from .tape import Tape
 from . import config
 
+# Minimum and maximum interval (in milliseconds) between polls of the log queue
+LOG_POLL_MIN = 100
+LOG_POLL_MAX = 1000
+
 
 class tapeimgrGUI(tk.Frame):
 
@@ -40,6 +46,10 @@ class tapeimgrGUI(tk.Frame):
         # Create a logging handler using a queue
         self.log_queue = queue.Queue(-1)
         self.queue_handler = QueueHandler(self.log_queue)
+        # Progress reports from the tape thread
+        self.progress_queue = queue.Queue(-1)
+        self.progressStartTime = None
+        self.progressLast = None
         # Create tape instance
         self.tape = Tape()
         self.t1 = None
@@ -52,6 +62,9 @@ class tapeimgrGUI(tk.Frame):
             self.tape.dirOut = os.path.expanduser("~")
         # Build the GUI
         self.build_gui()
+        # Start polling log messages and progress reports
+        self.after(LOG_POLL_MIN, self.poll_log_queue)
+        self.after(500, self.poll_progress_queue)
 
     def on_quit(self, event=None):
         """Quit tapeimgr"""
@@ -101,7 +114,23 @@ class tapeimgrGUI(tk.Frame):
         if not self.tape.filesIsValid:
             inputValidateFlag = False
             msg = ('Files value not valid\n'
-                   '(must be comma-delimited string of integer numbers, or empty)')
+                   '(must be comma-delimited string of integer numbers or ranges, '
+                   'e.g. 1-50,200-, or empty)')
+            tkMessageBox.showerror("ERROR", msg)
+
+        if not self.tape.compressionIsValid:
+            inputValidateFlag = False
+            msg = ('Compression settings in configuration file not valid')
+            tkMessageBox.showerror("ERROR", msg)
+
+        if not self.tape.chunkStoreIsValid:
+            inputValidateFlag = False
+            msg = ('Chunk store in configuration file is not a writable directory')
+            tkMessageBox.showerror("ERROR", msg)
+
+        if not self.tape.algorithmsIsValid:
+            inputValidateFlag = False
+            msg = ('Checksum algorithms in configuration file not valid')
             tkMessageBox.showerror("ERROR", msg)
 
         # Ask confirmation if output files exist already
@@ -117,8 +146,6 @@ class tapeimgrGUI(tk.Frame):
             successLogger = True
             try:
                 self.setupLogger()
-                # Start polling log messages from the queue
-                self.after(100, self.poll_log_queue)
             except OSError:
                 # Something went wrong while trying to write to lof file
                 msg = ('error trying to write log file to ' + self.tape.logFile)
@@ -143,6 +170,11 @@ class tapeimgrGUI(tk.Frame):
                 self.start_button.config(state='disabled')
                 self.quit_button.config(state='disabled')
 
+                # Progress reports go to the progress panel
+                self.tape.progressQueue = self.progress_queue
+                self.progressStartTime = time.perf_counter()
+                self.progressLast = None
+
                 # Launch tape processing function as subprocess
                 self.t1 = threading.Thread(target=self.tape.processTape)
                 self.t1.start()
@@ -228,7 +260,7 @@ class tapeimgrGUI(tk.Frame):
         self.increaseBSButton.grid(column=2, row=7, sticky='w')
 
         # Files
-        tk.Label(self, text='Files (comma-separated list)').grid(column=0, row=8, sticky='w')
+        tk.Label(self, text='Files (e.g. 1-50,200-)').grid(column=0, row=8, sticky='w')
         self.files_entry = tk.Entry(self, width=20)
         self.files_entry['background'] = 'white'
         self.files_entry.insert(tk.END, self.tape.files)
@@ -299,11 +331,30 @@ class tapeimgrGUI(tk.Frame):
 
         ttk.Separator(self, orient='horizontal').grid(column=0, row=18, columnspan=4, sticky='ew')
 
+        # Progress panel
+        tk.Label(self, text='Current file').grid(column=0, row=19, sticky='w')
+        self.progressFile_label = tk.Label(self, text='')
+        self.progressFile_label.grid(column=1, row=19, sticky='w')
+        tk.Label(self, text='Read from file').grid(column=0, row=20, sticky='w')
+        self.progressFileBytes_label = tk.Label(self, text='')
+        self.progressFileBytes_label.grid(column=1, row=20, sticky='w')
+        tk.Label(self, text='Read from tape').grid(column=0, row=21, sticky='w')
+        self.progressTapeBytes_label = tk.Label(self, text='')
+        self.progressTapeBytes_label.grid(column=1, row=21, sticky='w')
+        tk.Label(self, text='Read rate (current / average)').grid(column=0, row=22, sticky='w')
+        self.progressRate_label = tk.Label(self, text='')
+        self.progressRate_label.grid(column=1, row=22, sticky='w')
+        tk.Label(self, text='Time remaining (full tape)').grid(column=0, row=23, sticky='w')
+        self.progressETA_label = tk.Label(self, text='')
+        self.progressETA_label.grid(column=1, row=23, sticky='w')
+
+        ttk.Separator(self, orient='horizontal').grid(column=0, row=24, columnspan=4, sticky='ew')
+
         # Add ScrolledText widget to display logging info
         self.st = ScrolledText.ScrolledText(self, state='disabled', height=15)
         self.st.configure(font='TkFixedFont')
         self.st['background'] = 'white'
-        self.st.grid(column=0, row=19, sticky='ew', columnspan=4)
+        self.st.grid(column=0, row=25, sticky='ew', columnspan=4)
 
         # Define bindings for keyboard shortcuts: buttons
         self.root.bind_all('<Control-Key-d>', self.selectOutputDirectory)
@@ -370,6 +421,15 @@ class tapeimgrGUI(tk.Frame):
         self.fBlocks.set(self.tape.fillBlocks)
         self.start_button.config(state='normal')
         self.quit_button.config(state='normal')
+        # Clear progress panel
+        self.progress_queue = queue.Queue(-1)
+        self.progressStartTime = None
+        self.progressLast = None
+        self.progressFile_label['text'] = ''
+        self.progressFileBytes_label['text'] = ''
+        self.progressTapeBytes_label['text'] = ''
+        self.progressRate_label['text'] = ''
+        self.progressETA_label['text'] = ''
 
     def setupLogger(self):
         """Set up logger configuration"""
@@ -387,25 +447,81 @@ class tapeimgrGUI(tk.Frame):
         self.queue_handler.setFormatter(formatter)
         self.logger.addHandler(self.queue_handler)
 
-    def display(self, record):
-        """Display log record in scrolledText widget"""
-        msg = self.queue_handler.format(record)
+    def display(self, records):
+        """Display list of log records in scrolledText widget, and remove the
+        oldest lines if it holds more than logDisplayLines lines"""
+        chunks = []
+        for record in records:
+            chunks.append(self.queue_handler.format(record) + '\n')
+            chunks.append(record.levelname)
         self.st.configure(state='normal')
-        self.st.insert(tk.END, msg + '\n', record.levelname)
+        # One insert call for all records
+        self.st.insert(tk.END, *chunks)
+        noLines = int(self.st.index('end-1c').split('.')[0]) - 1
+        if noLines > self.tape.logDisplayLines:
+            # Older lines are only kept in the log file
+            self.st.delete('1.0', str(noLines - self.tape.logDisplayLines + 1) + '.0')
         self.st.configure(state='disabled')
         # Autoscroll to the bottom
         self.st.yview(tk.END)
 
     def poll_log_queue(self):
-        """Check every 100ms if there is a new message in the queue to display"""
+        """Display all new messages in the queue. The interval until the next
+        poll grows with the time needed to display the messages, so that a
+        flood of messages doesn't block the GUI"""
+        # Only the most recent records can end up in the widget
+        records = collections.deque(maxlen=self.tape.logDisplayLines)
+        while True:
+            try:
+                records.append(self.log_queue.get(block=False))
+            except queue.Empty:
+                break
+        interval = LOG_POLL_MIN
+        if records:
+            startTime = time.perf_counter()
+            self.display(records)
+            displayTime = int((time.perf_counter() - startTime) * 1000)
+            interval = min(max(10 * displayTime, LOG_POLL_MIN), LOG_POLL_MAX)
+        self.after(interval, self.poll_log_queue)
+
+    def showProgress(self, report):
+        """Show progress report in progress panel"""
+        self.progressFile_label['text'] = str(report['file'])
+        self.progressFileBytes_label['text'] = formatSize(report['fileBytes'])
+        self.progressTapeBytes_label['text'] = formatSize(report['tapeBytes'])
+
+        # Current rate from the last two reports, average rate since start
+        rate = 0.0
+        if self.progressLast is not None and report['time'] > self.progressLast['time']:
+            rate = ((report['tapeBytes'] - self.progressLast['tapeBytes']) /
+                    (report['time'] - self.progressLast['time']))
+        averageRate = 0.0
+        if self.progressStartTime is not None and report['time'] > self.progressStartTime:
+            averageRate = report['tapeBytes'] / (report['time'] - self.progressStartTime)
+        self.progressRate_label['text'] = (formatSize(rate) + '/s / ' +
+                                           formatSize(averageRate) + '/s')
+
+        # Time remaining if cartridge capacity is known
+        capacity = self.tape.tapeCapacity * 1e9
+        if capacity > 0 and averageRate > 0:
+            remaining = max(capacity - report['tapeBytes'], 0) / averageRate
+            self.progressETA_label['text'] = str(datetime.timedelta(seconds=int(remaining)))
+        else:
+            self.progressETA_label['text'] = 'unknown'
+
+        self.progressLast = report
+
+    def poll_progress_queue(self):
+        """Check every 500ms for progress reports, and show the latest one"""
+        report = None
         while True:
             try:
-                record = self.log_queue.get(block=False)
+                report = self.progress_queue.get(block=False)
             except queue.Empty:
                 break
-            else:
-                self.display(record)
-        self.after(100, self.poll_log_queue)
+        if report is not None:
+            self.showProgress(report)
+        self.after(500, self.poll_progress_queue)
 
 
 class QueueHandler(logging.Handler):
@@ -424,6 +540,19 @@ class QueueHandler(logging.Handler):
         self.log_queue.put(record)
 
 
+def formatSize(noBytes):
+    """Format number of bytes as human-readable string"""
+    for unit in ['bytes', 'KB', 'MB', 'GB']:
+        if noBytes < 1000:
+            break
+        noBytes /= 1000
+    else:
+        unit = 'TB'
+    if unit == 'bytes':
+        return str(int(noBytes)) + ' bytes'
+    return '{:.1f} {}'.format(noBytes, unit)
+
+
 def checkDirExists(dirIn):
     """Check if directory exists and exit if not"""
     if not os.path.isdir(dirIn):
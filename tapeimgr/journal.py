@@ -0,0 +1,93 @@
+#! /usr/bin/env python3
+"""This module contains the Journal class, which keeps track of the files
+that were completely extracted during a tape run, so that an interrupted
+run can be resumed.
+
+The journal is a text file in JSON Lines format. The first line describes
+the run; each following line describes one extracted file. Each line is
+flushed to disk (fsync) before the next file is read, so after a crash the
+journal never lists a file that is not completely on disk.
+"""
+
+import os
+import io
+import json
+import logging
+
+
+class Journal:
+    """Journal class"""
+
+    def __init__(self, fileName):
+        """initialise Journal class instance"""
+        self.fileName = fileName
+        # Run description, and list of file entries (dictionaries)
+        self.header = {}
+        self.entries = []
+
+    def writeLine(self, item, mode):
+        """Write item as one line, and flush it to disk. Returns True on success"""
+        try:
+            with io.open(self.fileName, mode, encoding='utf-8') as f:
+                f.write(json.dumps(item, sort_keys=True) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+        except OSError as e:
+            logging.error('cannot write journal ' + self.fileName + ': ' + str(e))
+            return False
+        return True
+
+    def start(self, header):
+        """Start new journal with header dictionary"""
+        self.header = header
+        self.entries = []
+        return self.writeLine(header, 'w')
+
+    def append(self, entry, syncFile=None):
+        """Add entry for an extracted file. If syncFile is given, that file is
+        flushed to disk first"""
+        if syncFile is not None:
+            try:
+                fd = os.open(syncFile, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            except OSError as e:
+                logging.error('cannot flush ' + syncFile + ' to disk: ' + str(e))
+                return False
+        self.entries.append(entry)
+        return self.writeLine(entry, 'a')
+
+    def read(self):
+        """Read journal; a last line that is incomplete (i.e. it was being
+        written when the run was interrupted) is ignored. Returns True on
+        success"""
+        self.header = {}
+        self.entries = []
+        try:
+            with io.open(self.fileName, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+        except OSError as e:
+            logging.error('cannot read journal ' + self.fileName + ': ' + str(e))
+            return False
+
+        for i, line in enumerate(lines):
+            try:
+                item = json.loads(line)
+            except ValueError:
+                if i == len(lines) - 1:
+                    logging.warning('ignoring incomplete last line of journal')
+                    break
+                logging.error('journal ' + self.fileName + ' is corrupted at line ' +
+                              str(i + 1))
+                return False
+            if i == 0:
+                self.header = item
+            else:
+                self.entries.append(item)
+
+        if not self.header:
+            logging.error('journal ' + self.fileName + ' is empty')
+            return False
+        return True
@@ -0,0 +1,108 @@
+#! /usr/bin/env python3
+"""This module contains the MapFile class, which records which blocks of
+one file on the tape were read, filled with null bytes, or not read at
+all (similar to the mapfiles of GNU ddrescue).
+
+A mapfile is a text file with some header lines (starting with #),
+followed by one line for each run of blocks with the same status:
+
+    # tapeimgr mapfile
+    # file: 3
+    # blockSize: 4096
+    # driveBlockSize: 0
+    # block blocks offset size status
+    120 37 0 151552 +
+    157 1 151552 4096 -
+    158 62 155648 253952 +
+
+Here block is the logical block number of the first block of the run on
+the tape (as reported by MTIOCPOS), blocks the number of blocks, offset
+and size the position and length of the run in the output file, and
+status is one of + (read), - (filled with null bytes) or ? (not read).
+A ? run with 0 blocks marks the point where reading of the file stopped;
+the rest of the file was not read.
+"""
+
+import io
+import logging
+
+STATUS_READ = '+'
+STATUS_FILLED = '-'
+STATUS_NOT_READ = '?'
+
+
+class MapFile:
+    """MapFile class"""
+
+    def __init__(self, fileNumber=0, blockSize=0, driveBlockSize=0):
+        """initialise MapFile class instance"""
+        self.fileNumber = fileNumber
+        self.blockSize = blockSize
+        # Block size of drive while reading (0 = variable block mode)
+        self.driveBlockSize = driveBlockSize
+        # List of [block, blocks, offset, size, status] lists
+        self.entries = []
+
+    def add(self, block, blocks, offset, size, status):
+        """Add run of blocks; merged with the previous run if it is adjacent
+        and has the same status"""
+        if self.entries:
+            last = self.entries[-1]
+            if (last[4] == status and last[0] + last[1] == block and
+                    last[2] + last[3] == offset and status != STATUS_NOT_READ):
+                last[1] += blocks
+                last[3] += size
+                return
+        self.entries.append([block, blocks, offset, size, status])
+
+    def badEntries(self):
+        """Return list of runs that were filled or not read"""
+        return [entry for entry in self.entries if entry[4] != STATUS_READ]
+
+    def isComplete(self):
+        """Return True if all blocks were read"""
+        return not self.badEntries()
+
+    def write(self, fileName):
+        """Write map to fileName, returns True on success"""
+        try:
+            with io.open(fileName, 'w', encoding='utf-8') as f:
+                f.write('# tapeimgr mapfile\n')
+                f.write('# file: ' + str(self.fileNumber) + '\n')
+                f.write('# blockSize: ' + str(self.blockSize) + '\n')
+                f.write('# driveBlockSize: ' + str(self.driveBlockSize) + '\n')
+                f.write('# block blocks offset size status\n')
+                for entry in self.entries:
+                    f.write(' '.join([str(item) for item in entry]) + '\n')
+        except OSError as e:
+            logging.error('cannot write mapfile ' + fileName + ': ' + str(e))
+            return False
+        return True
+
+
+def readMapFile(fileName):
+    """Read mapfile, returns MapFile instance, or None if it could not be read"""
+    fileMap = MapFile()
+    try:
+        with io.open(fileName, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line.startswith('#'):
+                    key, _, value = line[1:].partition(':')
+                    key = key.strip()
+                    if key == 'file':
+                        fileMap.fileNumber = int(value)
+                    elif key == 'blockSize':
+                        fileMap.blockSize = int(value)
+                    elif key == 'driveBlockSize':
+                        fileMap.driveBlockSize = int(value)
+                elif line:
+                    block, blocks, offset, size, status = line.split()
+                    if status not in [STATUS_READ, STATUS_FILLED, STATUS_NOT_READ]:
+                        raise ValueError('unknown status ' + status)
+                    fileMap.entries.append([int(block), int(blocks), int(offset),
+                                            int(size), status])
+    except (OSError, ValueError) as e:
+        logging.error('cannot read mapfile ' + fileName + ': ' + str(e))
+        return None
+    return fileMap
@@ -0,0 +1,486 @@
+#! /usr/bin/env python3
+"""This module contains the TapeDevice class, which controls a tape device
+through the Linux magnetic tape (MTIO) ioctl interface on one open file
+descriptor, as well as the backends that are used by it.
+"""
+
+import os
+import time
+import errno
+import struct
+import logging
+try:
+    import fcntl
+except ImportError:
+    # Not available on non-Unix platforms; only the simulated backend works there
+    fcntl = None
+
+# Tape operations, see linux/mtio.h
+MTRESET = 0
+MTFSF = 1
+MTBSF = 2
+MTFSR = 3
+MTBSR = 4
+MTWEOF = 5
+MTREW = 6
+MTOFFL = 7
+MTNOP = 8
+MTEOM = 12
+MTSETBLK = 20
+MTSEEK = 22
+
+# Operations that move the tape
+POSITION_OPERATIONS = [MTFSF, MTBSF, MTFSR, MTBSR, MTREW, MTOFFL, MTEOM, MTSEEK]
+
+# Generic status bits in mt_gstat
+GMT_EOF = 0x80000000
+GMT_BOT = 0x40000000
+GMT_EOT = 0x20000000
+GMT_SM = 0x10000000
+GMT_EOD = 0x08000000
+GMT_WR_PROT = 0x04000000
+GMT_ONLINE = 0x01000000
+GMT_DR_OPEN = 0x00040000
+
+# Block size and density are packed into mt_dsreg
+MT_ST_BLKSIZE_MASK = 0xffffff
+MT_ST_DENSITY_SHIFT = 24
+
+# Layouts of struct mtop, struct mtget and struct mtpos
+MTOP_FORMAT = 'hi'
+MTGET_FORMAT = 'lllllii'
+MTPOS_FORMAT = 'l'
+
+
+def _ioc(direction, number, structFormat):
+    """Return ioctl request code, equivalent of the _IOC macro"""
+    return ((direction << 30) | (struct.calcsize(structFormat) << 16) |
+            (ord('m') << 8) | number)
+
+
+MTIOCTOP = _ioc(1, 1, MTOP_FORMAT)
+MTIOCGET = _ioc(2, 2, MTGET_FORMAT)
+MTIOCPOS = _ioc(2, 3, MTPOS_FORMAT)
+
+
+class TapeStatus:
+    """Tape drive status, as reported by MTIOCGET"""
+    def __init__(self, fileNumber, blockNumber, blockSize, density, flags):
+        """initialise TapeStatus class instance"""
+        self.fileNumber = fileNumber
+        self.blockNumber = blockNumber
+        self.blockSize = blockSize
+        self.density = density
+        self.flags = flags
+
+    @property
+    def bot(self):
+        """True if tape is at beginning of tape"""
+        return bool(self.flags & GMT_BOT)
+
+    @property
+    def eof(self):
+        """True if tape is positioned just after a filemark"""
+        return bool(self.flags & GMT_EOF)
+
+    @property
+    def eot(self):
+        """True if tape is at (physical) end of tape"""
+        return bool(self.flags & GMT_EOT)
+
+    @property
+    def eod(self):
+        """True if tape is at end of recorded data"""
+        return bool(self.flags & GMT_EOD)
+
+    @property
+    def online(self):
+        """True if drive is online (i.e. a tape is loaded)"""
+        return bool(self.flags & GMT_ONLINE)
+
+    @property
+    def writeProtected(self):
+        """True if tape is write protected"""
+        return bool(self.flags & GMT_WR_PROT)
+
+    def __str__(self):
+        flagNames = [name for name, flag in [('BOT', GMT_BOT), ('EOF', GMT_EOF),
+                                             ('EOT', GMT_EOT), ('EOD', GMT_EOD),
+                                             ('WR_PROT', GMT_WR_PROT),
+                                             ('ONLINE', GMT_ONLINE),
+                                             ('DR_OPEN', GMT_DR_OPEN)]
+                     if self.flags & flag]
+        return ('file number: ' + str(self.fileNumber) +
+                ', block number: ' + str(self.blockNumber) +
+                ', block size: ' + str(self.blockSize) +
+                ', density: ' + hex(self.density) +
+                ', flags: ' + ' '.join(flagNames))
+
+
+class IoctlBackend:
+    """Backend that controls a tape device through fcntl.ioctl calls"""
+    def __init__(self, deviceName):
+        """initialise IoctlBackend class instance"""
+        self.deviceName = deviceName
+        self.fd = None
+
+    def open(self):
+        """Open the device"""
+        self.fd = os.open(self.deviceName, os.O_RDONLY)
+
+    def close(self):
+        """Close the device"""
+        os.close(self.fd)
+        self.fd = None
+
+    def readinto(self, buffer):
+        """Read from device into buffer, return number of bytes read"""
+        return os.readv(self.fd, [buffer])
+
+    def operation(self, operation, count):
+        """Perform MTIOCTOP operation"""
+        if fcntl is None:
+            raise OSError(errno.ENOTTY, 'ioctl not supported on this platform')
+        fcntl.ioctl(self.fd, MTIOCTOP, struct.pack(MTOP_FORMAT, operation, count))
+
+    def status(self):
+        """Return status (MTIOCGET) as a TapeStatus instance"""
+        if fcntl is None:
+            raise OSError(errno.ENOTTY, 'ioctl not supported on this platform')
+        result = fcntl.ioctl(self.fd, MTIOCGET, bytes(struct.calcsize(MTGET_FORMAT)))
+        mtType, resid, dsreg, gstat, erreg, fileNo, blkNo = struct.unpack(MTGET_FORMAT,
+                                                                          result)
+        return TapeStatus(fileNo, blkNo, dsreg & MT_ST_BLKSIZE_MASK,
+                          (dsreg >> MT_ST_DENSITY_SHIFT) & 0xff, gstat & 0xffffffff)
+
+    def position(self):
+        """Return logical block position (MTIOCPOS)"""
+        if fcntl is None:
+            raise OSError(errno.ENOTTY, 'ioctl not supported on this platform')
+        result = fcntl.ioctl(self.fd, MTIOCPOS, bytes(struct.calcsize(MTPOS_FORMAT)))
+        return struct.unpack(MTPOS_FORMAT, result)[0]
+
+
+class SimulatedBackend:
+    """Backend that simulates a tape in memory, following the behaviour of
+    the Linux SCSI tape driver. The tape is a list of files, and each file
+    is a list of records (bytes objects). Each file is followed by a
+    filemark; the end of the last file marks the end of data. Read errors
+    can be injected through badRecords, a dictionary with (fileIndex,
+    recordIndex) tuples as keys, and as values the number of read attempts
+    that fail before the record can be read (-1 means it never can)"""
+
+    def __init__(self, files, badRecords=None):
+        """initialise SimulatedBackend class instance"""
+        self.files = files
+        self.badRecords = badRecords or {}
+        self.fileIndex = 0
+        self.recordIndex = 0
+        self.blockSize = 0
+        self.isOpen = False
+        self.loaded = True
+        self.eod = False
+        # Number of operations that moved the tape, and of read calls
+        self.positionOperations = 0
+        self.readCalls = 0
+
+    def open(self):
+        """Open the device"""
+        self.isOpen = True
+
+    def close(self):
+        """Close the device"""
+        self.isOpen = False
+
+    def loadTape(self, files):
+        """Load a (simulated) tape, as done by a media changer"""
+        self.files = files
+        self.fileIndex = 0
+        self.recordIndex = 0
+        self.loaded = True
+
+    def unloadTape(self):
+        """Remove the tape from the drive"""
+        self.files = []
+        self.fileIndex = 0
+        self.recordIndex = 0
+        self.loaded = False
+
+    def checkReady(self):
+        """Raise OSError if device is not open or no tape is loaded"""
+        if not self.isOpen:
+            raise OSError(errno.EBADF, 'device not open')
+        if not self.loaded:
+            raise OSError(errno.ENOMEDIUM, 'no tape loaded')
+
+    def atEndOfData(self):
+        """Return True if tape is positioned at end of data"""
+        return self.fileIndex >= len(self.files)
+
+    def atFilemark(self):
+        """Return True if tape is positioned at a filemark or end of data"""
+        return (self.atEndOfData() or
+                self.recordIndex >= len(self.files[self.fileIndex]))
+
+    def readRecord(self):
+        """Return next record of current file, None if at filemark. Raises OSError
+        at end of data"""
+        if self.atEndOfData():
+            self.eod = True
+            raise OSError(errno.EIO, 'end of data')
+        records = self.files[self.fileIndex]
+        if self.recordIndex >= len(records):
+            # Filemark: position tape after it
+            self.fileIndex += 1
+            self.recordIndex = 0
+            return None
+        key = (self.fileIndex, self.recordIndex)
+        # As with a real drive, the tape moves past a record that can't be read
+        self.recordIndex += 1
+        failures = self.badRecords.get(key, 0)
+        if failures != 0:
+            if failures > 0:
+                self.badRecords[key] = failures - 1
+            raise OSError(errno.EIO, 'read error (injected)')
+        return records[self.recordIndex - 1]
+
+    def readinto(self, buffer):
+        """Read from tape into buffer, return number of bytes read"""
+        self.checkReady()
+        self.readCalls += 1
+        self.eod = False
+        size = len(buffer)
+
+        if self.blockSize == 0:
+            # Variable block mode: one record per read
+            record = self.readRecord()
+            if record is None:
+                return 0
+            if len(record) > size:
+                raise OSError(errno.ENOMEM, 'record larger than read buffer')
+            buffer[:len(record)] = record
+            return len(record)
+
+        # Fixed block mode: read as many blocks as fit in buffer
+        if size % self.blockSize != 0:
+            raise OSError(errno.EINVAL, 'read size is not a multiple of the block size')
+        noBytes = 0
+        while noBytes < size:
+            if noBytes != 0 and self.atFilemark():
+                # Filemark is returned by the next read
+                break
+            record = self.readRecord()
+            if record is None:
+                break
+            if len(record) != self.blockSize:
+                raise OSError(errno.EIO, 'record size does not match block size')
+            buffer[noBytes:noBytes + len(record)] = record
+            noBytes += len(record)
+        return noBytes
+
+    def operation(self, operation, count):
+        """Perform tape operation"""
+        self.checkReady()
+        self.eod = False
+        if operation in POSITION_OPERATIONS:
+            self.positionOperations += 1
+
+        if operation == MTFSF:
+            for _ in range(count):
+                if self.atEndOfData():
+                    self.eod = True
+                    raise OSError(errno.EIO, 'end of data')
+                self.fileIndex += 1
+                self.recordIndex = 0
+        elif operation == MTBSF:
+            for _ in range(count):
+                if self.fileIndex == 0:
+                    self.recordIndex = 0
+                    raise OSError(errno.EIO, 'beginning of tape')
+                self.fileIndex -= 1
+                self.recordIndex = len(self.files[self.fileIndex])
+        elif operation == MTFSR:
+            for _ in range(count):
+                if self.atEndOfData():
+                    self.eod = True
+                    raise OSError(errno.EIO, 'end of data')
+                if self.atFilemark():
+                    # Spacing stops after the filemark
+                    self.fileIndex += 1
+                    self.recordIndex = 0
+                    raise OSError(errno.EIO, 'filemark')
+                self.recordIndex += 1
+        elif operation == MTBSR:
+            for _ in range(count):
+                if self.recordIndex == 0:
+                    if self.fileIndex > 0:
+                        self.fileIndex -= 1
+                        self.recordIndex = len(self.files[self.fileIndex])
+                    raise OSError(errno.EIO, 'filemark')
+                self.recordIndex -= 1
+        elif operation == MTREW:
+            self.fileIndex = 0
+            self.recordIndex = 0
+        elif operation == MTOFFL:
+            self.fileIndex = 0
+            self.recordIndex = 0
+            self.loaded = False
+        elif operation == MTEOM:
+            self.fileIndex = len(self.files)
+            self.recordIndex = 0
+        elif operation == MTSETBLK:
+            self.blockSize = count
+        elif operation == MTSEEK:
+            self.seek(count)
+        elif operation != MTNOP:
+            raise OSError(errno.EINVAL, 'operation not supported')
+
+    def seek(self, block):
+        """Position tape at logical block number, where (as with SCSI
+        logical block addresses) each filemark also counts as a block"""
+        self.fileIndex = 0
+        self.recordIndex = 0
+        while not self.atEndOfData() and block > len(self.files[self.fileIndex]):
+            block -= len(self.files[self.fileIndex]) + 1
+            self.fileIndex += 1
+        if self.atEndOfData():
+            self.eod = True
+            raise OSError(errno.EIO, 'end of data')
+        self.recordIndex = block
+
+    def status(self):
+        """Return status as a TapeStatus instance"""
+        if not self.isOpen:
+            raise OSError(errno.EBADF, 'device not open')
+        flags = 0
+        if self.loaded:
+            flags |= GMT_ONLINE
+            if self.fileIndex == 0 and self.recordIndex == 0:
+                flags |= GMT_BOT
+            if self.atEndOfData() or self.eod:
+                flags |= GMT_EOD
+            elif self.fileIndex > 0 and self.recordIndex == 0:
+                flags |= GMT_EOF
+        else:
+            flags |= GMT_DR_OPEN
+        return TapeStatus(self.fileIndex, self.recordIndex, self.blockSize, 0, flags)
+
+    def position(self):
+        """Return logical block position"""
+        self.checkReady()
+        block = 0
+        for i in range(min(self.fileIndex, len(self.files))):
+            block += len(self.files[i]) + 1
+        return block + self.recordIndex
+
+
+class TapeDevice:
+    """TapeDevice class; all operations use one file descriptor, which is
+    opened on first use. Positioning operations return True on success and
+    False on failure; the error is stored in lastError"""
+    def __init__(self, deviceName, backend=None):
+        """initialise TapeDevice class instance"""
+        self.deviceName = deviceName
+        if backend is None:
+            backend = IoctlBackend(deviceName)
+        self.backend = backend
+        self.isOpen = False
+        self.lastError = None
+        # Number of operations that moved the tape, and time spent in them
+        self.positionOperations = 0
+        self.positionTime = 0.0
+
+    def open(self):
+        """Open the device, returns True on success"""
+        if not self.isOpen:
+            try:
+                self.backend.open()
+                self.isOpen = True
+            except OSError as e:
+                self.lastError = e
+        return self.isOpen
+
+    def close(self):
+        """Close the device; this is needed before any external tool (e.g. dd)
+        can access it"""
+        if self.isOpen:
+            self.backend.close()
+            self.isOpen = False
+
+    def readinto(self, buffer):
+        """Read from device into buffer, return number of bytes read. A return
+        value of 0 means a filemark was read. Raises OSError on read errors"""
+        if not self.isOpen:
+            self.backend.open()
+            self.isOpen = True
+        return self.backend.readinto(buffer)
+
+    def operation(self, operation, count=1):
+        """Perform MTIOCTOP operation, returns True on success"""
+        if not self.open():
+            return False
+        startTime = time.perf_counter()
+        try:
+            self.backend.operation(operation, count)
+            return True
+        except OSError as e:
+            self.lastError = e
+            logging.debug('tape operation ' + str(operation) + ' ' + str(count) +
+                          ' failed: ' + str(e))
+            return False
+        finally:
+            if operation in POSITION_OPERATIONS:
+                self.positionOperations += 1
+                self.positionTime += time.perf_counter() - startTime
+
+    def fsf(self, count=1):
+        """Forward space count filemarks"""
+        return self.operation(MTFSF, count)
+
+    def bsf(self, count=1):
+        """Backward space count filemarks"""
+        return self.operation(MTBSF, count)
+
+    def fsr(self, count=1):
+        """Forward space count records"""
+        return self.operation(MTFSR, count)
+
+    def bsr(self, count=1):
+        """Backward space count records"""
+        return self.operation(MTBSR, count)
+
+    def rewind(self):
+        """Rewind tape"""
+        return self.operation(MTREW)
+
+    def eject(self):
+        """Rewind and unload tape"""
+        return self.operation(MTOFFL)
+
+    def setBlockSize(self, blockSize):
+        """Set block size; 0 switches drive to variable block mode"""
+        return self.operation(MTSETBLK, blockSize)
+
+    def seek(self, block):
+        """Position tape at logical block number"""
+        return self.operation(MTSEEK, block)
+
+    def status(self):
+        """Return TapeStatus instance, or None if status could not be read"""
+        if not self.open():
+            return None
+        try:
+            return self.backend.status()
+        except OSError as e:
+            self.lastError = e
+            return None
+
+    def tell(self):
+        """Return logical block position, or None if it could not be read"""
+        if not self.open():
+            return None
+        try:
+            return self.backend.position()
+        except OSError as e:
+            self.lastError = e
+            return None
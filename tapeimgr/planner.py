@@ -0,0 +1,86 @@
+#! /usr/bin/env python3
+"""This module contains the FilePlanner class, which decides which file on
+the tape is read next, and how far the tape must be spaced forward to get
+there.
+
+The selection of files is a comma-separated list of file numbers and
+ranges, e.g. '2,5-8,200-'. A range without an end ('200-') runs to the end
+of the tape. An empty selection selects all files.
+"""
+
+
+def parseFileRanges(files):
+    """Parse selection string files, and return sorted list of
+    non-overlapping [first, last] ranges, where last is None for a range
+    that runs to the end of the tape. Raises ValueError if files is not
+    valid"""
+    ranges = []
+    if files.strip() == '':
+        return ranges
+
+    for item in files.split(','):
+        first, separator, last = item.strip().partition('-')
+        first = int(first)
+        if not separator:
+            last = first
+        elif last.strip() == '':
+            last = None
+        else:
+            last = int(last)
+        if first < 1 or (last is not None and last < first):
+            raise ValueError('invalid file range ' + item)
+        ranges.append([first, last])
+
+    # Sort and merge overlapping or adjacent ranges
+    ranges.sort(key=lambda r: r[0])
+    merged = [ranges[0]]
+    for first, last in ranges[1:]:
+        previous = merged[-1]
+        if previous[1] is None or first <= previous[1] + 1:
+            if previous[1] is not None and (last is None or last > previous[1]):
+                previous[1] = last
+        else:
+            merged.append([first, last])
+    return merged
+
+
+class FilePlanner:
+    """FilePlanner class"""
+
+    def __init__(self, ranges):
+        """initialise FilePlanner class instance; ranges as returned by
+        parseFileRanges"""
+        self.ranges = ranges
+        # Files that need not be read (e.g. completed in an interrupted run)
+        self.completedFiles = set()
+
+    def lastFile(self):
+        """Return number of last selected file, or None if the selection
+        runs to the end of the tape"""
+        if not self.ranges:
+            return None
+        return self.ranges[-1][1]
+
+    def nextFile(self, file):
+        """Return number of first file from file onwards that must be read,
+        or None if no files are left"""
+        while True:
+            if self.ranges:
+                for first, last in self.ranges:
+                    if last is None or file <= last:
+                        file = max(file, first)
+                        break
+                else:
+                    return None
+            if file not in self.completedFiles:
+                return file
+            file += 1
+
+    def skipCount(self, file):
+        """Return number of files that must be skipped (with a single
+        forward space operation) to get from file to the next file that
+        must be read, or None if no files are left"""
+        nextFile = self.nextFile(file)
+        if nextFile is None:
+            return None
+        return nextFile - file
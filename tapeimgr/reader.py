@@ -0,0 +1,386 @@
+#! /usr/bin/env python3
+"""This module contains the Reader class, which copies one file from
+a (non-rewind) tape device to an output file without calling dd.
+"""
+
+import io
+import time
+import logging
+import queue
+import threading
+from .shared import MultiHash, DEFAULT_ALGORITHM
+from .mapfile import MapFile, STATUS_READ, STATUS_FILLED, STATUS_NOT_READ
+from .compression import CompressedWriter
+from .chunkstore import ChunkWriter, CHUNK_SIZE
+
+# Minimum interval (in seconds) between progress reports
+PROGRESS_INTERVAL = 0.5
+
+# Granularity (in bytes) at which runs of null bytes are skipped in sparse
+# output files (the block size of most file systems)
+SPARSE_BLOCK_SIZE = 4096
+ZERO_SPARSE_BLOCK = bytes(SPARSE_BLOCK_SIZE)
+
+class Reader:
+    """Reader class. The tape is read by the calling thread, and a separate
+    writer thread writes the data to disk. Both are connected by a ring of
+    preallocated buffers, so that a short stall on the output file system
+    doesn't stop the tape drive"""
+    def __init__(self, blockSize, bufferSize, fillBlocks=False, bufferCount=4,
+                 writeLimiter=None, hashLimiter=None, codec=None, compressionWorkers=0,
+                 sparse=False, store=None, chunkSize=CHUNK_SIZE, algorithms=None):
+        """initialise Reader class instance"""
+
+        # Size of one block (record) on the tape
+        self.blockSize = blockSize
+        # Pad unreadable blocks with null bytes (equivalent of dd's conv=noerror,sync)
+        self.fillBlocks = fillBlocks
+        # Read buffer is a multiple of the block size, rounded up so that it
+        # is never smaller than requested (in variable block mode bufferSize
+        # covers the largest record that can be read)
+        self.bufferSize = max(-(-bufferSize // blockSize), 1) * blockSize
+        # Ring of preallocated buffers, reused for every read
+        self.bufferCount = max(bufferCount, 2)
+        self.freeBuffers = queue.Queue()
+        for _ in range(self.bufferCount):
+            self.freeBuffers.put(bytearray(self.bufferSize))
+        self.nullBlock = bytes(blockSize)
+        # Semaphores that cap the number of concurrent disk writers and hashers
+        # across readers (e.g. when several drives are imaged at the same time)
+        self.writeLimiter = writeLimiter or threading.Lock()
+        self.hashLimiter = hashLimiter or threading.Lock()
+        # Digest algorithms (hashlib names) that are computed on the fly
+        self.algorithms = algorithms or [DEFAULT_ALGORITHM]
+        # Optional compression codec (see compression module); the writer
+        # thread hands the data to a pool of compression workers
+        self.codec = codec
+        self.compressionWorkers = compressionWorkers
+        # Optional chunk store (see chunkstore module); if there is one, fileOut
+        # is the manifest
+        self.store = store
+        self.chunkSize = chunkSize
+        # Seek over blocks of null bytes instead of writing them (sparse output
+        # file); not used with compression or a chunk store
+        self.sparse = sparse and codec is None and store is None
+        # Statistics for the last file that was read
+        self.bytesRead = 0
+        self.bytesWritten = 0
+        self.bytesCompressed = 0
+        self.bytesSparse = 0
+        self.chunks = 0
+        self.newChunks = 0
+        self.bytesStored = 0
+        self.readCalls = 0
+        self.readErrors = 0
+        self.bytesPadded = 0
+        self.peakBuffers = 0
+        self.digests = {}
+        self.writeError = None
+        # Map of blocks that were read, filled or not read
+        self.map = MapFile()
+        # Time (in seconds) spent reading the tape, writing and hashing
+        self.readTime = 0.0
+        self.writeTime = 0.0
+        self.hashTime = 0.0
+
+    def readFile(self, device, fileOut, progress=None):
+        """Read records from device (a TapeDevice instance) until a filemark
+        (zero-length read) is reached, and write them to fileOut. The digests of all
+        bytes written (SHA-512, and any other algorithms) are computed on the fly
+        (before compression, if a codec is used). If progress is given, it is called
+        with the number of bytes read so far at most every PROGRESS_INTERVAL seconds.
+        Returns True on success, False otherwise"""
+
+        self.bytesRead = 0
+        self.bytesWritten = 0
+        self.bytesCompressed = 0
+        self.bytesSparse = 0
+        self.chunks = 0
+        self.newChunks = 0
+        self.bytesStored = 0
+        self.readCalls = 0
+        self.readErrors = 0
+        self.bytesPadded = 0
+        self.peakBuffers = 0
+        self.digests = {}
+        self.writeError = None
+        self.readTime = 0.0
+        self.writeTime = 0.0
+        self.hashTime = 0.0
+        m = MultiHash(self.algorithms)
+        success = True
+
+        if self.store is not None:
+            # Manifest is written when fOut is closed
+            fOut = ChunkWriter(self.store, fileOut, self.chunkSize)
+        else:
+            try:
+                fOut = io.open(fileOut, 'wb')
+            except OSError as e:
+                logging.error('cannot write to ' + fileOut + ': ' + str(e))
+                m.close()
+                return False
+            if self.codec is not None:
+                fOut = CompressedWriter(fOut, self.codec, self.compressionWorkers)
+
+        # Buffers that were filled by the reader, and are waiting to be written
+        filledBuffers = queue.Queue()
+        writer = threading.Thread(target=self.writeBuffers,
+                                  args=(filledBuffers, fOut, m),
+                                  name=threading.current_thread().name + '-writer')
+        writer.start()
+        nextProgress = time.perf_counter() + PROGRESS_INTERVAL
+
+        # The tape position is tracked for the map, and so that the region
+        # covered by a failed read can be read again at block granularity
+        position = device.tell()
+        driveBlockSize = 0
+        tapeStatus = device.status()
+        if tapeStatus is not None:
+            driveBlockSize = tapeStatus.blockSize
+        self.map = MapFile(0, self.blockSize, driveBlockSize)
+
+        while True:
+            if self.writeError is not None:
+                break
+
+            buffer = self.freeBuffers.get()
+            self.readCalls += 1
+            startTime = time.perf_counter()
+            try:
+                noBytes = device.readinto(buffer)
+            except OSError as e:
+                self.readTime += time.perf_counter() - startTime
+                self.freeBuffers.put(buffer)
+                if self.fillBlocks:
+                    logging.error('read error: ' + str(e))
+                    tapeStatus = device.status()
+                    if tapeStatus is not None and (tapeStatus.eod or tapeStatus.eot):
+                        # File ends without a filemark, so there is nothing to fill
+                        logging.error('end of data reached before filemark')
+                        break
+                    if position is not None and device.tell() == position:
+                        # Tape didn't move, so reading on would fail forever
+                        logging.error('tape did not move after read error, '
+                                      'cannot read rest of file')
+                        self.readErrors += 1
+                        self.map.add(position, 0, self.bytesRead + self.bytesPadded,
+                                     0, STATUS_NOT_READ)
+                        success = False
+                        break
+                    position, endOfFile = self.recoverRegion(device, filledBuffers,
+                                                             position, driveBlockSize)
+                    if endOfFile:
+                        break
+                    continue
+                self.readErrors += 1
+                logging.error('read error: ' + str(e))
+                if position is not None:
+                    # Rest of the file is not read
+                    self.map.add(position, 0, self.bytesRead + self.bytesPadded,
+                                 0, STATUS_NOT_READ)
+                success = False
+                break
+            self.readTime += time.perf_counter() - startTime
+
+            if not noBytes:
+                # Filemark (or end of input)
+                self.freeBuffers.put(buffer)
+                break
+
+            if position is not None:
+                if driveBlockSize == 0:
+                    # Variable block mode: one record per read
+                    noBlocks = 1
+                else:
+                    noBlocks = noBytes // driveBlockSize
+                self.map.add(position, noBlocks, self.bytesRead + self.bytesPadded,
+                             noBytes, STATUS_READ)
+                position += noBlocks
+
+            self.bytesRead += noBytes
+            filledBuffers.put((buffer, noBytes))
+            self.peakBuffers = max(self.peakBuffers, filledBuffers.qsize())
+
+            if progress is not None and time.perf_counter() >= nextProgress:
+                progress(self.bytesRead)
+                nextProgress = time.perf_counter() + PROGRESS_INTERVAL
+
+        # Signal end of file to writer, and wait until it is done
+        filledBuffers.put(None)
+        writer.join()
+
+        try:
+            if self.sparse and self.writeError is None:
+                # Set the file size, in case the file ends with skipped bytes
+                fOut.truncate()
+            fOut.close()
+        except Exception as e:
+            if self.writeError is None:
+                self.writeError = e
+        if self.codec is not None:
+            self.bytesCompressed = fOut.bytesOut
+        if self.store is not None:
+            self.chunks = len(fOut.chunks)
+            self.newChunks = fOut.newChunks
+            self.bytesStored = fOut.bytesStored
+
+        if self.writeError is not None:
+            logging.error('cannot write to ' + fileOut + ': ' + str(self.writeError))
+            success = False
+
+        self.digests = m.hexdigests()
+        m.close()
+        if progress is not None:
+            progress(self.bytesRead)
+
+        logging.info('bytes read: ' + str(self.bytesRead) +
+                     ', bytes written: ' + str(self.bytesWritten) +
+                     (', bytes compressed: ' + str(self.bytesCompressed)
+                      if self.codec is not None else '') +
+                     (', bytes skipped (sparse): ' + str(self.bytesSparse)
+                      if self.sparse else '') +
+                     (', chunks: ' + str(self.chunks) + ' (' + str(self.newChunks) +
+                      ' new, ' + str(self.bytesStored) + ' bytes stored)'
+                      if self.store is not None else '') +
+                     ', read calls: ' + str(self.readCalls) +
+                     ', read errors: ' + str(self.readErrors) +
+                     ', bytes padded: ' + str(self.bytesPadded) +
+                     ', peak buffer occupancy: ' + str(self.peakBuffers) +
+                     '/' + str(self.bufferCount))
+
+        return success
+
+    def padBlocks(self, filledBuffers, noBlocks, block):
+        """Queue noBlocks blocks of null bytes for the writer; block is the
+        number of the first block on the tape (None if unknown)"""
+        if block is not None:
+            self.map.add(block, noBlocks, self.bytesRead + self.bytesPadded,
+                         noBlocks * self.blockSize, STATUS_FILLED)
+        for _ in range(noBlocks):
+            filledBuffers.put((self.nullBlock, self.blockSize))
+        self.readErrors += noBlocks
+        self.bytesPadded += noBlocks * self.blockSize
+
+    def recoverRegion(self, device, filledBuffers, startBlock, driveBlockSize):
+        """Handle a failed read that started at block number startBlock. A read
+        that covered a single record (always the case in variable block mode) is
+        padded with one block of null bytes. A read that covered several blocks
+        is repeated one block at a time, so that only the blocks that can't be
+        read are padded. Returns (position, endOfFile) tuple, where position is
+        the block number after the region (None if unknown), and endOfFile is
+        True if a filemark was read"""
+
+        endBlock = device.tell()
+        if startBlock is None or endBlock is None or endBlock <= startBlock + 1:
+            logging.error('filling block with null bytes')
+            self.padBlocks(filledBuffers, 1, startBlock)
+            return endBlock, False
+
+        noBlocks = endBlock - startBlock
+        if driveBlockSize == 0 or not device.seek(startBlock):
+            # Cannot go back, so give up on the whole region
+            logging.error('cannot re-read blocks ' + str(startBlock) + '-' +
+                          str(endBlock - 1) + ', filling them with null bytes')
+            self.padBlocks(filledBuffers, noBlocks, startBlock)
+            return endBlock, False
+
+        logging.info('re-reading blocks ' + str(startBlock) + '-' +
+                     str(endBlock - 1) + ' one at a time')
+        for block in range(startBlock, endBlock):
+            buffer = self.freeBuffers.get()
+            self.readCalls += 1
+            try:
+                with memoryview(buffer) as view:
+                    noBytes = device.readinto(view[:driveBlockSize])
+            except OSError as e:
+                self.freeBuffers.put(buffer)
+                logging.error('read error in block ' + str(block) + ': ' + str(e) +
+                              ', filling block with null bytes')
+                self.padBlocks(filledBuffers, 1, block)
+                continue
+            if not noBytes:
+                self.freeBuffers.put(buffer)
+                return None, True
+            self.map.add(block, 1, self.bytesRead + self.bytesPadded, noBytes, STATUS_READ)
+            self.bytesRead += noBytes
+            filledBuffers.put((buffer, noBytes))
+
+        return endBlock, False
+
+    def writeBuffers(self, filledBuffers, fOut, m):
+        """Writer thread: hash and write filled buffers until None is received,
+        and hand the buffers back to the reader"""
+
+        while True:
+            item = filledBuffers.get()
+            if item is None:
+                break
+            buffer, noBytes = item
+
+            if self.writeError is None:
+                with memoryview(buffer) as view:
+                    startTime = time.perf_counter()
+                    with self.hashLimiter:
+                        m.update(view[:noBytes])
+                    self.hashTime += time.perf_counter() - startTime
+                    startTime = time.perf_counter()
+                    try:
+                        with self.writeLimiter:
+                            if self.sparse:
+                                self.bytesWritten += self.writeSparse(fOut, buffer, noBytes)
+                            else:
+                                self.bytesWritten += fOut.write(view[:noBytes])
+                    except Exception as e:
+                        # Any error (including codec and chunk store errors) is
+                        # recorded, and draining continues so the reader never
+                        # blocks
+                        self.writeError = e
+                    self.writeTime += time.perf_counter() - startTime
+
+            if buffer is not self.nullBlock:
+                self.freeBuffers.put(buffer)
+
+    def writeSparse(self, fOut, buffer, noBytes):
+        """Write first noBytes of buffer to fOut, but seek over runs of null
+        bytes that cover whole SPARSE_BLOCK_SIZE blocks of the output file
+        instead of writing them. Returns the number of bytes written or
+        skipped"""
+
+        # Offset of the first block boundary of the output file in buffer
+        i = -self.bytesWritten % SPARSE_BLOCK_SIZE
+        # Start of the bytes that are not written yet
+        start = 0
+        with memoryview(buffer) as view:
+            while i + SPARSE_BLOCK_SIZE <= noBytes:
+                if not buffer.startswith(ZERO_SPARSE_BLOCK, i):
+                    i += SPARSE_BLOCK_SIZE
+                    continue
+                end = i + SPARSE_BLOCK_SIZE
+                while (end + SPARSE_BLOCK_SIZE <= noBytes and
+                       buffer.startswith(ZERO_SPARSE_BLOCK, end)):
+                    end += SPARSE_BLOCK_SIZE
+                if start < i:
+                    fOut.write(view[start:i])
+                fOut.seek(end - i, io.SEEK_CUR)
+                self.bytesSparse += end - i
+                start = i = end
+            if start < noBytes:
+                fOut.write(view[start:noBytes])
+        return noBytes
+
+
+def readRecordSize(device, maxBlockSize):
+    """Read one record from device into a buffer of maxBlockSize bytes,
+    and return a (success, size) tuple. In variable block mode the
+    number of bytes returned by a single read equals the size of the
+    record. A size of 0 means a filemark was read"""
+
+    buffer = bytearray(maxBlockSize)
+    try:
+        noBytes = device.readinto(buffer)
+    except OSError as e:
+        logging.info('single record read failed: ' + str(e))
+        return False, 0
+
+    return True, noBytes
@@ -2,15 +2,66 @@
 """Shared functions module"""
 
 import os
+import io
+import lzma
+import zlib
 import logging
-import glob
 import hashlib
 import datetime
+import threading
+import collections
 import subprocess as sub
+from concurrent.futures import ThreadPoolExecutor
 import pytz
+from . import compression
+from .chunkstore import ManifestReader, MANIFEST_EXTENSION
 
-def launchSubProcess(args, writeLog=True):
-    """Launch subprocess and return exit code, stdout and stderr"""
+# Digest algorithm that is always computed (checksum file and the checksums
+# in the metadata file)
+DEFAULT_ALGORITHM = 'sha512'
+
+# Errors that reading an extracted file may raise: damaged gzip data raise
+# zlib.error, damaged bzip2 data OSError or EOFError, damaged xz data
+# LZMAError, and a manifest that can't be read ValueError
+READ_ERRORS = (OSError, EOFError, ValueError, zlib.error, lzma.LZMAError)
+
+# Number of output lines that are kept for the return value of launchSubProcess
+# in streaming mode, and maximum length (in bytes) of one line
+TAIL_LINES = 100
+MAX_LINE_LENGTH = 65536
+
+
+class ThreadFilter(logging.Filter):
+    """Logging filter that passes only records that were emitted by one
+    thread, or by any of its helper threads (whose names start with the
+    name of that thread, followed by a dash)"""
+
+    def __init__(self, threadName):
+        super().__init__()
+        self.threadName = threadName
+
+    def filter(self, record):
+        return (record.threadName == self.threadName or
+                record.threadName.startswith(self.threadName + '-'))
+
+
+def readPipe(pipe, tail, logPrefix):
+    """Read lines from pipe until it is closed, log them (unless logPrefix is
+    None), and keep the last ones in tail (a deque)"""
+    for line in iter(lambda: pipe.readline(MAX_LINE_LENGTH), b''):
+        line = line.decode('utf-8', errors='replace').rstrip('\r\n')
+        tail.append(line)
+        if logPrefix is not None:
+            logging.info(logPrefix + line)
+    pipe.close()
+
+
+def launchSubProcess(args, writeLog=True, stream=False):
+    """Launch subprocess and return exit code, stdout and stderr. In streaming
+    mode stdout and stderr are read line by line while the subprocess runs,
+    each line is logged as soon as it arrives, and only the last TAIL_LINES
+    lines of each are returned"""
+    cmdName = args[0]
     try:
         # Execute command line; stdout + stderr redirected to objects
         # 'output' and 'errors'.
@@ -18,11 +69,36 @@ def launchSubProcess(args, writeLog=True):
         # BUT shell=True is not working with argument lists,
         # see https://stackoverflow.com/a/26417712/1209004
         p = sub.Popen(args, stdout=sub.PIPE, stderr=sub.PIPE, shell=False)
-        output, errors = p.communicate()
 
-        # Decode to UTF8
-        outputAsString = output.decode('utf-8')
-        errorsAsString = errors.decode('utf-8')
+        if stream:
+            if writeLog:
+                logging.info('Command: ' + ' '.join(args))
+            outputTail = collections.deque(maxlen=TAIL_LINES)
+            errorsTail = collections.deque(maxlen=TAIL_LINES)
+            # One reader thread for each pipe, so neither of them can fill up
+            readers = []
+            for pipe, tail, name in [(p.stdout, outputTail, 'stdout'),
+                                     (p.stderr, errorsTail, 'stderr')]:
+                logPrefix = None
+                if writeLog:
+                    logPrefix = cmdName + ' ' + name + ': '
+                reader = threading.Thread(target=readPipe,
+                                          args=(pipe, tail, logPrefix),
+                                          name=threading.current_thread().name + '-' + name)
+                reader.start()
+                readers.append(reader)
+            for reader in readers:
+                reader.join()
+            p.wait()
+
+            outputAsString = '\n'.join(outputTail)
+            errorsAsString = '\n'.join(errorsTail)
+        else:
+            output, errors = p.communicate()
+
+            # Decode to UTF8
+            outputAsString = output.decode('utf-8', errors='replace')
+            errorsAsString = errors.decode('utf-8', errors='replace')
 
         exitStatus = p.returncode
 
@@ -34,8 +110,15 @@ def launchSubProcess(args, writeLog=True):
         errorsAsString = ""
 
     # Logging
-    if writeLog:
-        cmdName = args[0]
+    if writeLog and stream:
+        # Output was already logged (at info level) while the subprocess ran,
+        # so if it failed the last lines of stderr are logged again as errors
+        if exitStatus == 0:
+            logging.info(cmdName + ' status: ' + str(exitStatus))
+        else:
+            logging.error(cmdName + ' status: ' + str(exitStatus))
+            logging.error(cmdName + ' stderr:\n' + errorsAsString)
+    elif writeLog:
         logging.info('Command: ' + ' '.join(args))
 
         if exitStatus == 0:
@@ -50,41 +133,178 @@ def launchSubProcess(args, writeLog=True):
     return(exitStatus, outputAsString, errorsAsString)
 
 
-def generate_file_sha512(fileIn):
-    """Generate sha512 hash of file"""
+def readSize(fileIn):
+    """Return read size for fileIn: small files are read in one go,
+    large files in chunks of up to 16 MiB"""
+    try:
+        fileSize = os.path.getsize(fileIn)
+    except OSError:
+        fileSize = 0
+    return min(max(fileSize, 2**16), 2**24)
+
+
+def openImage(fileIn):
+    """Open extracted file fileIn for reading; compressed files are
+    decompressed, and files in a chunk store are read through their
+    manifest"""
+    if fileIn.endswith('.' + MANIFEST_EXTENSION):
+        return ManifestReader(fileIn)
+    return compression.openFile(fileIn)
+
+
+def findImage(directory, fName):
+    """Return path of extracted file fName in directory, which may be stored
+    as is, compressed or as a manifest; returns None if it doesn't exist"""
+    candidates = [fName, fName + '.' + MANIFEST_EXTENSION]
+    candidates += [fName + '.' + codec.extension for codec in compression.CODECS.values()]
+    for candidate in candidates:
+        path = os.path.join(directory, candidate)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def imageName(fileName):
+    """Return name of the extracted file that is stored as fileName, i.e.
+    without the extension of a manifest or compression codec"""
+    if fileName.endswith('.' + MANIFEST_EXTENSION):
+        return fileName[:-len(MANIFEST_EXTENSION) - 1]
+    return compression.stripExtension(fileName)
+
+
+def parseAlgorithms(algorithms):
+    """Parse comma-separated string of hashlib algorithm names, and return
+    list of algorithms, which always starts with DEFAULT_ALGORITHM. Raises
+    ValueError if an algorithm is not available, or has no fixed digest
+    size (e.g. shake_128)"""
+    algorithmsList = [DEFAULT_ALGORITHM]
+    for algorithm in algorithms.split(','):
+        algorithm = algorithm.strip().lower()
+        if algorithm == '' or algorithm in algorithmsList:
+            continue
+        if hashlib.new(algorithm).digest_size == 0:
+            raise ValueError('algorithm ' + algorithm + ' has no fixed digest size')
+        algorithmsList.append(algorithm)
+    return algorithmsList
+
+
+class MultiHash:
+    """Computes the digests of several hashlib algorithms in one pass over
+    the data. If there is more than one algorithm, the digests are updated
+    in parallel threads (hashlib releases the GIL while hashing)"""
+
+    def __init__(self, algorithms):
+        """initialise MultiHash class instance"""
+        self.hashes = collections.OrderedDict()
+        for algorithm in algorithms:
+            self.hashes[algorithm] = hashlib.new(algorithm)
+        self.executor = None
+        if len(self.hashes) > 1:
+            self.executor = ThreadPoolExecutor(max_workers=len(self.hashes) - 1)
+
+    def update(self, data):
+        """Update all digests with data"""
+        hashes = list(self.hashes.values())
+        if self.executor is None:
+            hashes[0].update(data)
+            return
+        # The calling thread updates the first digest
+        futures = [self.executor.submit(m.update, data) for m in hashes[1:]]
+        hashes[0].update(data)
+        for future in futures:
+            future.result()
+
+    def hexdigests(self):
+        """Return dictionary with algorithms as keys and digests (hexadecimal
+        strings) as values"""
+        return {algorithm: m.hexdigest() for algorithm, m in self.hashes.items()}
+
+    def close(self):
+        """Stop worker threads"""
+        if self.executor is not None:
+            self.executor.shutdown()
+
+
+def generate_file_digests(fileIn, algorithms, blocksize=None):
+    """Generate digests of file for list of algorithms, and return them as a
+    dictionary; compressed files are hashed after decompression, and
+    manifests after reassembly"""
 
     # fileIn is read in chunks to ensure it will work with (very) large files as well
     # Adapted from: http://stackoverflow.com/a/1131255/1209004
 
-    blocksize = 2**20
-    m = hashlib.sha512()
-    with open(fileIn, "rb") as f:
-        while True:
-            buf = f.read(blocksize)
-            if not buf:
-                break
-            m.update(buf)
-    return m.hexdigest()
+    if blocksize is None:
+        blocksize = readSize(fileIn)
+    m = MultiHash(algorithms)
+    buf = bytearray(blocksize)
+    view = memoryview(buf)
+    try:
+        with openImage(fileIn) as f:
+            if imageName(fileIn) == fileIn and hasattr(os, 'posix_fadvise'):
+                # Plain file: tell the kernel to read ahead aggressively
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            while True:
+                noBytes = f.readinto(buf)
+                if not noBytes:
+                    break
+                m.update(view[:noBytes])
+    finally:
+        m.close()
+    return m.hexdigests()
+
+
+def digestFiles(files, algorithms, workers=0, limiter=None, failed=None):
+    """Calculate digests for list of files and list of algorithms; returns
+    dictionary with algorithms as keys, and dictionaries with file base names
+    (without the extension of any compression codec or manifest) as keys,
+    sorted by name, as values. Files are hashed in parallel by a pool of
+    worker threads (hashlib releases the GIL while hashing); if workers is 0
+    the number of CPUs is used. The optional limiter semaphore caps the
+    number of files that are hashed at the same time across concurrent calls.
+    Files that can't be read (e.g. damaged compressed files) are logged and
+    left out of the result, and added to the failed list if one is given"""
 
+    if workers <= 0:
+        workers = os.cpu_count() or 1
 
-def checksumDirectory(directory, extension, checksumFile):
-    """Calculate checksums for all files in directory"""
+    def hashFile(fileIn):
+        """Hash one file, holding the limiter if there is one; returns
+        digests and error message (None on success)"""
+        try:
+            if limiter is None:
+                return generate_file_digests(fileIn, algorithms), None
+            with limiter:
+                return generate_file_digests(fileIn, algorithms), None
+        except READ_ERRORS as e:
+            return None, str(e)
 
-    # All files in directory
-    allFiles = glob.glob(directory + "/*." + extension)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(hashFile, files))
 
     # Dictionary for storing results
-    checksums = {}
+    digests = {algorithm: {} for algorithm in algorithms}
+
+    fileDigests = []
+    for fileIn, (hexDigests, error) in zip(files, results):
+        if hexDigests is None:
+            # Logged here, so the record goes to the log of the calling thread
+            logging.error('cannot read ' + fileIn + ': ' + error)
+            if failed is not None:
+                failed.append(fileIn)
+        else:
+            fileDigests.append((imageName(os.path.basename(fileIn)), hexDigests))
+    for fName, hexDigests in sorted(fileDigests, key=lambda item: item[0]):
+        for algorithm in algorithms:
+            digests[algorithm][fName] = hexDigests[algorithm]
+
+    return digests
 
-    for thisFile in allFiles:
-        hashString = generate_file_sha512(thisFile)
-        fName = os.path.basename(thisFile)
-        checksums[fName] = hashString
 
-    # Write checksum file
+def writeChecksums(checksums, checksumFile):
+    """Write checksums dictionary to checksum file"""
     try:
         fChecksum = open(checksumFile, "w", encoding="utf-8")
-        for fName in checksums:
+        for fName in sorted(checksums):
             lineOut = checksums[fName] + " " + fName + '\n'
             fChecksum.write(lineOut)
         fChecksum.close()
@@ -92,7 +312,52 @@ def checksumDirectory(directory, extension, checksumFile):
     except IOError:
         wroteChecksums = False
 
-    return wroteChecksums, checksums
+    return wroteChecksums
+
+
+def readChecksums(checksumFile):
+    """Read checksum file (in the format written by writeChecksums, or by
+    tools such as sha512sum), and return dictionary with file names as keys
+    and checksums as values. Raises OSError or ValueError if it can't be
+    read"""
+    checksums = {}
+    with io.open(checksumFile, 'r', encoding='utf-8') as fChecksum:
+        for line in fChecksum:
+            line = line.rstrip('\r\n')
+            if line.strip() == '':
+                continue
+            hashString, separator, fName = line.partition(' ')
+            if not separator:
+                raise ValueError('invalid line in ' + checksumFile + ': ' + line)
+            # sha512sum separates name with two spaces, or space and asterisk
+            if fName[:1] in [' ', '*']:
+                fName = fName[1:]
+            checksums[fName] = hashString.lower()
+    return checksums
+
+
+def verifyDigests(directory, digests, workers=0, limiter=None, extension=''):
+    """Re-read files in digests dictionary (as returned by digestFiles) from
+    directory, computing all digests in one pass, and return list of
+    (file, algorithm) tuples for which the digest doesn't match (which
+    includes files that are missing or can't be read). Extension is added to
+    the file names (e.g. '.gz' for compressed files, or '.manifest' for files
+    in a chunk store)"""
+
+    algorithms = list(digests)
+    fNames = sorted(set(fName for algorithm in algorithms for fName in digests[algorithm]))
+    files = [os.path.join(directory, fName + extension) for fName in fNames]
+    digestsVerify = digestFiles([f for f in files if os.path.isfile(f)], algorithms,
+                                workers, limiter)
+
+    mismatches = []
+    for algorithm in algorithms:
+        for fName in digests[algorithm]:
+            if digestsVerify[algorithm].get(fName) != digests[algorithm][fName]:
+                mismatches.append((fName, algorithm))
+
+    return mismatches
+
 
 def generateDateTime(timeZone):
     """Generate date / time string in ISO format with added time zone info"""
@@ -9,8 +9,19 @@ import json
 import time
 import logging
 import glob
+import threading
 from . import config
 from . import shared
+from .reader import Reader
+from .reader import readRecordSize
+from .reader import PROGRESS_INTERVAL
+from .mtio import TapeDevice
+from .mapfile import MapFile, readMapFile, STATUS_READ, STATUS_FILLED
+from .journal import Journal
+from .planner import FilePlanner, parseFileRanges
+from . import compression
+from .chunkstore import ChunkStore, CHUNK_SIZE, MANIFEST_EXTENSION
+from . import virtualtape
 
 class Tape:
     """Tape class"""
@@ -54,12 +65,77 @@ class Tape:
         self.successFlag = True
         self.configSuccess = True
         self.endOfTape = False
-        self.extractFile = False
         self.file = 1
-        self.filesList = []
+        # Selected file ranges, and planner that decides which file is read next
+        self.fileRanges = []
+        self.planner = None
         self.blockSize = 0
         self.timeZone = ''
         self.defaultDir = ''
+        self.readMethod = 'internal'
+        self.readBufferSize = 1048576
+        self.bufferCount = 4
+        self.verifyChecksums = False
+        self.checksumWorkers = 0
+        self.checksums = {}
+        # Digest algorithms (comma-separated hashlib names) in addition to
+        # SHA-512, and digests for each algorithm (self.checksums holds the
+        # SHA-512 ones)
+        self.checksumAlgorithms = ''
+        self.algorithms = [shared.DEFAULT_ALGORITHM]
+        self.digests = {shared.DEFAULT_ALGORITHM: self.checksums}
+        self.algorithmsIsValid = True
+        self.variableBlockMode = True
+        self.maxBlockSize = 1048576
+        self.blockSizeProbes = []
+        # TapeDevice instance, and backend used by it (None means ioctl backend)
+        self.device = None
+        self.deviceBackend = None
+        # Block size setting of the drive before it was read (None if unknown);
+        # restored when the tape is ejected
+        self.originalBlockSize = None
+        # Optional semaphores that cap concurrent disk writers and hashers
+        # when several tapes are processed at the same time
+        self.writeLimiter = None
+        self.hashLimiter = None
+        self.acquisitionStart = ''
+        # Wall time (in seconds) spent in each processing phase
+        self.phaseTimes = {}
+        # Performance metrics for each extracted file, and number of subprocesses
+        # and time spent in them
+        self.fileMetrics = []
+        self.subProcessCount = 0
+        self.subProcessTime = 0.0
+        # Optional queue that receives progress reports (e.g. from the GUI),
+        # bytes read from the tape so far, and cartridge capacity in GB (0 = unknown)
+        self.progressQueue = None
+        self.tapeBytes = 0
+        self.tapeCapacity = 0
+        # Maximum number of lines in the GUI's log window
+        self.logDisplayLines = 10000
+        # Retry pass: only read the blocks that failed in an earlier run
+        self.retryMode = False
+        self.bytesRecovered = 0
+        self.retriedFiles = []
+        # Journal of completed files, and resume flag (continue interrupted run)
+        self.journalFileName = 'journal.jsonl'
+        self.journalFile = ''
+        self.journal = None
+        self.resume = False
+        # Compression of output files (empty = no compression); the level is
+        # empty for the codec's default, and 0 workers means one per CPU
+        self.compression = ''
+        self.compressionLevel = ''
+        self.compressionWorkers = 0
+        self.codec = None
+        self.compressionIsValid = True
+        # Write runs of null bytes as holes in sparse output files
+        self.sparseFiles = True
+        # Chunk store directory (empty = write plain files), and chunk size
+        self.chunkStoreDir = ''
+        self.chunkSize = CHUNK_SIZE
+        self.store = None
+        self.chunkStoreIsValid = True
 
     def getConfiguration(self):
         """read configuration file and set variables accordingly"""
@@ -93,6 +169,32 @@ class Tape:
             except KeyError:
                 self.configSuccess = False
 
+            # Settings that were added in later versions; use defaults if
+            # they are missing from an older configuration file
+            try:
+                self.readMethod = configDict.get('readMethod', self.readMethod)
+                self.readBufferSize = int(configDict.get('readBufferSize', self.readBufferSize))
+                self.bufferCount = int(configDict.get('bufferCount', self.bufferCount))
+                self.verifyChecksums = bool(configDict.get('verifyChecksums', 'False') == "True")
+                self.checksumWorkers = int(configDict.get('checksumWorkers', self.checksumWorkers))
+                self.variableBlockMode = bool(configDict.get('variableBlockMode', 'True') == "True")
+                self.maxBlockSize = int(configDict.get('maxBlockSize', self.maxBlockSize))
+                self.tapeCapacity = float(configDict.get('tapeCapacity', self.tapeCapacity))
+                self.logDisplayLines = max(int(configDict.get('logDisplayLines',
+                                                              self.logDisplayLines)), 1)
+                self.journalFileName = configDict.get('journalFileName', self.journalFileName)
+                self.compression = configDict.get('compression', self.compression)
+                self.compressionLevel = configDict.get('compressionLevel', self.compressionLevel)
+                self.compressionWorkers = int(configDict.get('compressionWorkers',
+                                                             self.compressionWorkers))
+                self.sparseFiles = bool(configDict.get('sparseFiles', 'True') == "True")
+                self.chunkStoreDir = configDict.get('chunkStore', self.chunkStoreDir)
+                self.chunkSize = int(configDict.get('chunkSize', self.chunkSize))
+                self.checksumAlgorithms = configDict.get('checksumAlgorithms',
+                                                         self.checksumAlgorithms)
+            except ValueError:
+                self.configSuccess = False
+
 
     def validateInput(self):
         """Validate and pre-process input"""
@@ -101,21 +203,18 @@ class Tape:
         self.dirOutIsDirectory = os.path.isdir(self.dirOut)
 
         # Check if glob pattern for dirOut, prefix and extension matches existing files
-        if glob.glob(self.dirOut + '/' + self.prefix + '*.' + self.extension):
+        # (also compressed files and mapfiles)
+        if glob.glob(self.dirOut + '/' + self.prefix + '*.' + self.extension + '*'):
             self.outputExistsFlag = True
 
         # Check if dirOut is writable
         self.dirOutIsWritable = os.access(self.dirOut, os.W_OK | os.X_OK)
 
         # Check if tape device is accessible
-        args = ['mt']
-        args.append('-f')
-        args.append(self.tapeDevice)
-        args.append('status')
-        mtStatus, mtOut, mtErr = shared.launchSubProcess(args, False)
-
-        if mtStatus == 0:
+        device = self.createDevice()
+        if device.status() is not None:
             self.deviceAccessibleFlag = True
+        device.close()
 
         # Check if initial block size is valid (i.e. a multiple of 512)
         try:
@@ -133,27 +232,102 @@ class Tape:
             self.blockSizeIsValid = False
 
         # Check if files entry is valid; also split files string
-        # to list of integers
-        if self.files.strip() == '':
-            # Empty string (default): OK
+        # to list of file ranges (empty string selects all files)
+        try:
+            self.fileRanges = parseFileRanges(self.files)
             self.filesIsValid = True
+        except ValueError:
+            # One or more items are not an integer or a range
+            self.filesIsValid = False
+
+        # Check if compression codec and level are valid
+        try:
+            level = None
+            if str(self.compressionLevel).strip() != '':
+                level = int(self.compressionLevel)
+            self.codec = compression.getCodec(self.compression, level)
+            self.compressionIsValid = True
+        except (KeyError, ValueError):
+            self.codec = None
+            self.compressionIsValid = False
+
+        # Check if chunk store (if any) is a writable directory
+        self.store = None
+        if self.chunkStoreDir.strip() == '':
+            self.chunkStoreIsValid = True
+        elif (os.path.isdir(self.chunkStoreDir) and
+              os.access(self.chunkStoreDir, os.W_OK | os.X_OK)):
+            self.store = ChunkStore(self.chunkStoreDir)
+            self.chunkStoreIsValid = self.chunkSize > 0
         else:
-            try:
-                # Each item in list is an integer: OK
-                self.filesList = [int(i) for i in self.files.split(',')]
-                self.filesIsValid = True
-            except ValueError:
-                # One or more items are not an integer
-                self.filesIsValid = False
+            self.chunkStoreIsValid = False
+
+        # Check if digest algorithms are valid
+        try:
+            self.algorithms = shared.parseAlgorithms(self.checksumAlgorithms)
+            self.algorithmsIsValid = True
+        except ValueError:
+            self.algorithms = [shared.DEFAULT_ALGORITHM]
+            self.algorithmsIsValid = False
+        self.checksums = {}
+        self.digests = {algorithm: {} for algorithm in self.algorithms}
+        self.digests[shared.DEFAULT_ALGORITHM] = self.checksums
 
         # Log file
         self.logFile = os.path.join(self.dirOut, self.logFileName)
 
+        # Journal file
+        self.journalFile = os.path.join(self.dirOut, self.journalFileName)
+
+    def settingsErrors(self):
+        """Return list of error messages for settings from the configuration
+        file that didn't pass validateInput"""
+        errors = []
+        if not self.compressionIsValid:
+            errors.append('compression settings not valid, check values of compression '
+                          'and compressionLevel in the configuration file')
+        if not self.chunkStoreIsValid:
+            errors.append("chunkStore '" + self.chunkStoreDir + "' in the configuration "
+                          "file is not a writable directory")
+        if not self.algorithmsIsValid:
+            errors.append("checksumAlgorithms '" + self.checksumAlgorithms + "' in the "
+                          "configuration file not valid")
+        return errors
+
+    def createDevice(self):
+        """Return TapeDevice instance for tapeDevice; virtual tapes
+        (vtape:/path/to/description.json) get a VirtualBackend"""
+        backend = self.deviceBackend
+        if backend is None and virtualtape.isVirtualDevice(self.tapeDevice):
+            backend = virtualtape.createBackend(self.tapeDevice)
+        return TapeDevice(self.tapeDevice, backend)
+
     def processTape(self):
         """Process a tape"""
 
-        # Create dictionary for storing metadata (which are later written to file)
-        metadata = {}
+        startTime = time.perf_counter()
+        if self.retryMode:
+            if self.retryTape():
+                self.ejectTape()
+                self.finishRetry()
+            else:
+                logging.info('Success: ' + str(self.successFlag))
+        elif self.extractTape():
+            self.ejectTape()
+            self.finishTape()
+        else:
+            logging.info('Success: ' + str(self.successFlag))
+        self.addPhaseTime('total', startTime)
+
+        # Set finishedFlag
+        self.finishedFlag = True
+
+        # Wait 2 seconds to avoid race condition
+        time.sleep(2)
+
+    def extractTape(self):
+        """Extract all (selected) files from the tape. Returns False if the
+        tape device is not accessible, True otherwise"""
 
         # Write some general info to log file
         logging.info('***************************')
@@ -167,47 +341,91 @@ class Tape:
         logging.info('prefix: ' + self.prefix)
         logging.info('extension: ' + self.extension)
         logging.info('fill blocks: ' + str(self.fillBlocks))
+        if virtualtape.isVirtualDevice(self.tapeDevice) and self.readMethod == 'dd':
+            # dd cannot read from a virtual tape
+            self.readMethod = 'internal'
+        logging.info('read method: ' + self.readMethod)
+        if self.codec is not None and self.readMethod == 'dd':
+            # dd writes its output file directly
+            logging.warning('compression is not supported with the dd read method, ' +
+                            'writing uncompressed files')
+            self.codec = None
+        if self.store is not None and self.readMethod == 'dd':
+            logging.warning('chunk store is not supported with the dd read method, ' +
+                            'writing plain files')
+            self.store = None
+        if self.store is not None and self.codec is not None:
+            logging.warning('compression is not used with a chunk store')
+            self.codec = None
+        if self.codec is not None:
+            logging.info('compression: ' + self.codec.name + ' (level ' +
+                         str(self.codec.level) + ')')
+        if self.store is not None:
+            logging.info('chunk store: ' + self.store.directory + ' (chunk size ' +
+                         str(self.chunkSize) + ')')
+        logging.info('checksum algorithms: ' + ', '.join(self.algorithms))
 
         ## Acquisition start date/time
-        acquisitionStart = shared.generateDateTime(self.timeZone)
+        self.acquisitionStart = shared.generateDateTime(self.timeZone)
 
-        if self.fillBlocks:
+        if self.fillBlocks and self.readMethod == 'dd':
             # dd's conv=sync flag results in padding bytes for each block if block
             # size is too large, so override user-defined value with default
-            # if -f flag was used
+            # if -f flag was used. The internal reader pads whole blocks of the
+            # established block size, so it doesn't need this
             self.initBlockSize = 512
             logging.info('Reset initial block size to 512 because -f flag is used')
 
         # Get tape status, output to log file
         logging.info('*** Getting tape status ***')
 
-        args = ['mt']
-        args.append('-f')
-        args.append(self.tapeDevice)
-        args.append('status')
-        mtStatus, mtOut, mtErr = shared.launchSubProcess(args)
+        self.device = self.createDevice()
+        tapeStatus = self.device.status()
 
-        if mtStatus != 0:
+        if tapeStatus is None:
             # Abort if tape device is not accessible
             self.tapeDeviceIOError = True
             self.successFlag = False
-            logging.critical('Exiting because tape device is not accessible')
-            logging.info('Success: ' + str(self.successFlag))
+            logging.critical('Exiting because tape device is not accessible: ' +
+                             str(self.device.lastError))
+            return False
 
-            # Wait 2 seconds to avoid race condition
-            time.sleep(2)
+        logging.info('Tape status: ' + str(tapeStatus))
+        self.originalBlockSize = tapeStatus.blockSize
 
-            # Set finishedFlag
-            self.finishedFlag = True
+        self.planner = FilePlanner(self.fileRanges)
+        self.journal = Journal(self.journalFile)
+        if self.resume:
+            if not self.resumeFromJournal():
+                self.successFlag = False
+                logging.critical('Exiting because interrupted run cannot be resumed')
+                return False
+        else:
+            header = {}
+            header['acquisitionStart'] = self.acquisitionStart
+            header['tapeDevice'] = self.tapeDevice
+            header['files'] = self.files
+            header['prefix'] = self.prefix
+            header['extension'] = self.extension
+            header['fillBlocks'] = self.fillBlocks
+            header['readMethod'] = self.readMethod
+            header.update(self.outputSettings())
+            if not self.journal.start(header):
+                self.successFlag = False
 
-        # Iterate over all files on tape until end is detected
+        # Iterate over the selected files until the last one is read, or the
+        # end of the tape is detected
         while not self.endOfTape:
-            # Only extract files defined by files parameter
-            # (if file parameter is empty all files are extracted)
-            if self.file in self.filesList or self.filesList == []:
-                self.extractFile = True
-            else:
-                self.extractFile = False
+            # Files that are not selected (or were completed in an interrupted
+            # run) are skipped in one operation
+            skipCount = self.planner.skipCount(self.file)
+            if skipCount is None:
+                logging.info('*** Last selected file extracted ***')
+                break
+            if skipCount > 0:
+                self.skipFiles(skipCount)
+                if self.endOfTape:
+                    break
 
             # Call file processing function
             self.processFile()
@@ -215,27 +433,182 @@ class Tape:
             # Increase file number
             self.file += 1
 
-        # Create checksum file
-        logging.info('*** Creating checksum file ***')
-        checksumFile = os.path.join(self.dirOut, self.checksumFileName)
-        writeFlag, checksums = shared.checksumDirectory(self.dirOut, self.extension, checksumFile)
+        return True
 
-        # Rewind and eject the tape
-        logging.info('*** Rewinding tape ***')
+    def outputSettings(self):
+        """Return dictionary with the settings that determine the format of
+        the output files, which must not change when a run is resumed"""
+        settings = {}
+        settings['compression'] = self.codec.name if self.codec is not None else ''
+        settings['compressionLevel'] = self.codec.level if self.codec is not None else ''
+        settings['chunkStore'] = self.store.directory if self.store is not None else ''
+        settings['algorithms'] = self.algorithms
+        return settings
+
+    def resumeFromJournal(self):
+        """Validate the journal of an interrupted run, restore the state of the
+        files it lists, and fast-forward the tape past the last of them in one
+        operation. Returns True on success, False otherwise"""
+
+        logging.info('*** Resuming interrupted run ***')
+        if not self.journal.read():
+            return False
+
+        header = self.journal.header
+        settings = {key: getattr(self, key) for key in ['files', 'prefix', 'extension']}
+        settings.update(self.outputSettings())
+        for key, value in settings.items():
+            if header.get(key) != value:
+                logging.error(key + " value '" + str(value) +
+                              "' differs from interrupted run ('" + str(header.get(key)) + "')")
+                return False
+
+        # Only files that are on disk with the recorded size count as completed
+        completed = []
+        for entry in self.journal.entries:
+            try:
+                size = os.path.getsize(os.path.join(self.dirOut, entry['fileName']))
+            except OSError:
+                size = None
+            if size != entry['size']:
+                logging.warning('file ' + entry['fileName'] + ' does not match journal, ' +
+                                'resuming from file # ' + str(entry['file']))
+                break
+            completed.append(entry)
+
+        # Rewrite journal without any entries that are not valid
+        if not self.journal.start(header):
+            return False
+        for entry in completed:
+            if not self.journal.append(entry):
+                return False
+
+        self.acquisitionStart = header.get('acquisitionStart', self.acquisitionStart)
+        if not completed:
+            logging.info('No completed files in journal, starting from file # 1')
+            return True
+
+        for entry in completed:
+            fName = shared.imageName(entry['fileName'])
+            if entry['checksum']:
+                self.checksums[fName] = entry['checksum']
+            for algorithm, digest in entry.get('digests', {}).items():
+                if algorithm in self.digests:
+                    self.digests[algorithm][fName] = digest
+            self.tapeBytes += entry['size']
+            if 'metrics' in entry:
+                self.fileMetrics.append(entry['metrics'])
+            if not entry['successFlag']:
+                self.successFlag = False
+
+        # The planner skips the completed files together with any files
+        # that are not selected
+        self.planner.completedFiles = set(entry['file'] for entry in completed)
+        logging.info('*** ' + str(len(completed)) + ' files are completed, up to file # ' +
+                     str(completed[-1]['file']) + ' ***')
+        startTime = time.perf_counter()
+        success = self.device.rewind()
+        self.addPhaseTime('positioning', startTime)
+        if not success:
+            logging.error('cannot rewind tape: ' + str(self.device.lastError))
+            return False
+
+        self.file = 1
+        return True
+
+    def checksumFileFor(self, algorithm):
+        """Return path of checksum file for algorithm; the file for SHA-512
+        is checksumFileName, and the others replace its extension with the
+        name of the algorithm"""
+        if algorithm == shared.DEFAULT_ALGORITHM:
+            return os.path.join(self.dirOut, self.checksumFileName)
+        return os.path.join(self.dirOut,
+                            os.path.splitext(self.checksumFileName)[0] + '.' + algorithm)
+
+    def writeChecksumFiles(self, digests):
+        """Write one checksum file for each algorithm in digests dictionary.
+        Returns True on success"""
+        writeFlag = True
+        for algorithm in digests:
+            if not shared.writeChecksums(digests[algorithm], self.checksumFileFor(algorithm)):
+                writeFlag = False
+        return writeFlag
 
-        args = ['mt']
-        args.append('-f')
-        args.append(self.tapeDevice)
-        args.append('rewind')
-        mtStatus, mtOut, mtErr = shared.launchSubProcess(args)
+    def ejectTape(self):
+        """Rewind and eject the tape, and release the tape device"""
+
+        startTime = time.perf_counter()
+        self.restoreBlockSize()
+        logging.info('*** Rewinding tape ***')
+        if not self.device.rewind():
+            logging.error('rewind failed: ' + str(self.device.lastError))
 
         logging.info('*** Ejecting tape ***')
+        if not self.device.eject():
+            logging.error('eject failed: ' + str(self.device.lastError))
+
+        self.device.close()
+        self.addPhaseTime('positioning', startTime)
+
+    def restoreBlockSize(self):
+        """Put the drive back in the block mode it was in before the tape was
+        read, as establishing the block size (and retrying blocks) changes it"""
+        tapeStatus = self.device.status()
+        if (self.originalBlockSize is None or tapeStatus is None or
+                tapeStatus.blockSize == self.originalBlockSize):
+            return
+        logging.info('*** Restoring drive block size to ' + str(self.originalBlockSize) +
+                     ' ***')
+        if not self.device.setBlockSize(self.originalBlockSize):
+            logging.error('cannot restore drive block size: ' + str(self.device.lastError))
+
+    def finishTape(self):
+        """Write checksum and metadata files. This doesn't need the tape device,
+        so it can run while the next tape is being loaded"""
+
+        # Create dictionary for storing metadata (which are later written to file)
+        metadata = {}
+
+        # Create checksum files
+        startTime = time.perf_counter()
+        logging.info('*** Creating checksum files ***')
+        if self.readMethod == 'dd':
+            # No checksums available yet, so read back all extracted files
+            # (computing all digests in one pass)
+            allFiles = glob.glob(self.dirOut + "/*." + self.extension)
+            failedFiles = []
+            digests = shared.digestFiles(allFiles, self.algorithms, self.checksumWorkers,
+                                         self.hashLimiter, failedFiles)
+            if failedFiles:
+                self.successFlag = False
+            writeFlag = self.writeChecksumFiles(digests)
+        else:
+            # Checksums were computed while reading the tape
+            digests = self.digests
+            writeFlag = self.writeChecksumFiles(digests)
+
+            if self.verifyChecksums:
+                # Optional verification: read back (and decompress) extracted
+                # files and compare
+                logging.info('*** Verifying checksums ***')
+                extension = ''
+                if self.store is not None:
+                    extension = '.' + MANIFEST_EXTENSION
+                elif self.codec is not None:
+                    extension = '.' + self.codec.extension
+                mismatches = shared.verifyDigests(self.dirOut, digests,
+                                                  self.checksumWorkers, self.hashLimiter,
+                                                  extension)
+                for fName, algorithm in mismatches:
+                    self.successFlag = False
+                    logging.error(algorithm + ' checksum mismatch for file ' + fName)
 
-        args = ['mt']
-        args.append('-f')
-        args.append(self.tapeDevice)
-        args.append('eject')
-        mtStatus, mtOut, mtErr = shared.launchSubProcess(args)
+        if not writeFlag:
+            self.successFlag = False
+            logging.error('error while writing checksum file')
+
+        self.addPhaseTime('checksums', startTime)
+        startTime = time.perf_counter()
 
         # Acquisition end date/time
         acquisitionEnd = shared.generateDateTime(self.timeZone)
@@ -251,11 +624,25 @@ class Tape:
         metadata['prefix'] = self.prefix
         metadata['extension'] = self.extension
         metadata['fillBlocks'] = self.fillBlocks
-        metadata['acquisitionStart'] = acquisitionStart
+        metadata['acquisitionStart'] = self.acquisitionStart
         metadata['acquisitionEnd'] = acquisitionEnd
         metadata['successFlag'] = self.successFlag
-        metadata['checksums'] = checksums
+        metadata['checksums'] = digests[shared.DEFAULT_ALGORITHM]
         metadata['checksumType'] = 'SHA-512'
+        metadata['digests'] = digests
+        metadata['fileMetrics'] = self.fileMetrics
+        metadata['phaseTimes'] = self.phaseTimes
+        metadata['positioningTime'] = self.device.positionTime
+        metadata['positioningOperations'] = self.device.positionOperations
+        metadata['subProcessCount'] = self.subProcessCount
+        metadata['subProcessTime'] = self.subProcessTime
+        metadata['resumed'] = self.resume
+        if self.codec is not None:
+            metadata['compression'] = self.codec.name
+            metadata['compressionLevel'] = self.codec.level
+        if self.store is not None:
+            metadata['chunkStore'] = self.store.directory
+            metadata['chunkSize'] = self.chunkSize
 
         # Write metadata to file in json format
         logging.info('*** Writing metadata file ***')
@@ -267,6 +654,8 @@ class Tape:
             self.successFlag = False
             logging.error('error while writing metadata file')
 
+        self.addPhaseTime('metadata', startTime)
+
         logging.info('Success: ' + str(self.successFlag))
 
         if self.successFlag:
@@ -275,109 +664,574 @@ class Tape:
             logging.error('One or more errors occurred while processing tape, \
             check log file for details')
 
-        # Set finishedFlag
-        self.finishedFlag = True
-
-        # Wait 2 seconds to avoid race condition
-        time.sleep(2)
-
     def processFile(self):
         """Process a file"""
 
-        if self.extractFile:
-            # Determine block size for this file
-            logging.info('*** Establishing blockSize ***')
-            self.findBlockSize()
-            logging.info('Block size: ' + str(self.blockSize))
+        # Determine block size for this file; this also detects the end of the tape
+        logging.info('*** Establishing blockSize ***')
+        startTime = time.perf_counter()
+        self.findBlockSize()
+        probeTime = time.perf_counter() - startTime
+        self.addPhaseTime('blockSize', startTime)
 
-            # Name of output file for this file
-            paddingChars = max(10 - len(self.prefix), 0)
-            ofName = self.prefix + str(self.file).zfill(paddingChars) + '.' + self.extension
-            ofName = os.path.join(self.dirOut, ofName)
-
-            logging.info('*** Extracting file # ' + str(self.file) + ' to file ' + ofName + ' ***')
+        if self.endOfTape:
+            logging.info('*** Reached end of tape ***')
+            return
 
-            args = ['dd']
-            args.append('if=' + self.tapeDevice)
-            args.append('of='+ ofName)
-            args.append('bs=' + str(self.blockSize))
+        logging.info('Block size: ' + str(self.blockSize))
 
-            if self.fillBlocks:
-                # Add conv=noerror,sync options to argument list
-                args.append('conv=noerror,sync')
+        # Name of output file for this file
+        paddingChars = max(10 - len(self.prefix), 0)
+        ofName = self.prefix + str(self.file).zfill(paddingChars) + '.' + self.extension
+        ofName = os.path.join(self.dirOut, ofName)
+        if self.store is not None:
+            ofName += '.' + MANIFEST_EXTENSION
+        elif self.codec is not None:
+            ofName += '.' + self.codec.extension
 
-            ddStatus, ddOut, ddErr = shared.launchSubProcess(args)
+        logging.info('*** Extracting file # ' + str(self.file) + ' to file ' + ofName + ' ***')
 
-            if ddStatus != 0:
-                self.successFlag = False
-                logging.error('dd encountered an error while reading the tape')
+        # Metrics for this file; the extract functions add the read statistics
+        self.fileMetrics.append({'file': self.file,
+                                 'fileName': os.path.basename(ofName),
+                                 'blockSize': self.blockSize,
+                                 'blockSizeProbes': len(self.blockSizeProbes),
+                                 'probeTime': probeTime})
 
+        # successFlag is reset for this file, so it tells if this file had errors
+        successBefore = self.successFlag
+        self.successFlag = True
+        startTime = time.perf_counter()
+        if self.readMethod == 'dd':
+            self.extractFileDd(ofName)
         else:
-            # Fast-forward tape to next file
+            self.extractFileInternal(ofName)
+        elapsedTime = time.perf_counter() - startTime
+        self.addPhaseTime('read', startTime)
+        fileSuccess = self.successFlag
+        self.successFlag = successBefore and fileSuccess
+
+        fileMetrics = self.fileMetrics[-1]
+        self.tapeBytes += fileMetrics['bytesRead']
+        fileMetrics['extractTime'] = elapsedTime
+        fileMetrics['throughputMBs'] = 0.0
+        if elapsedTime > 0:
+            fileMetrics['throughputMBs'] = fileMetrics['bytesRead'] / elapsedTime / 1e6
+
+        # Record completed file in journal
+        entry = {}
+        entry['file'] = self.file
+        entry['fileName'] = os.path.basename(ofName)
+        try:
+            entry['size'] = os.path.getsize(ofName)
+        except OSError:
+            entry['size'] = 0
+        entry['blockSize'] = self.blockSize
+        fName = shared.imageName(entry['fileName'])
+        entry['checksum'] = self.checksums.get(fName, '')
+        entry['digests'] = {algorithm: self.digests[algorithm][fName]
+                            for algorithm in self.algorithms if fName in self.digests[algorithm]}
+        entry['successFlag'] = fileSuccess
+        entry['metrics'] = fileMetrics
+        if not self.journal.append(entry, ofName):
+            self.successFlag = False
+
+    def skipFiles(self, count):
+        """Fast-forward tape over count files, in one operation"""
+        if count == 1:
             logging.info('*** Skipping file # ' + str(self.file) +
                          ', fast-forward to next file ***')
+        else:
+            logging.info('*** Skipping files # ' + str(self.file) + '-' +
+                         str(self.file + count - 1) + ', fast-forward to file # ' +
+                         str(self.file + count) + ' ***')
 
-            args = ['mt']
-            args.append('-f')
-            args.append(self.tapeDevice)
-            args.append('fsf')
-            args.append('1')
-            mtStatus, mtOut, mtErr = shared.launchSubProcess(args, False)
-
-        # Try to position tape 1 record forward; if this fails this means
-        # the end of the tape was reached
-        args = ['mt']
-        args.append('-f')
-        args.append(self.tapeDevice)
-        args.append('fsr')
-        args.append('1')
-        mtStatus, mtOut, mtErr = shared.launchSubProcess(args, False)
-
-        if mtStatus == 0:
-            # Another file exists. Position tape one record backward
-            args = ['mt']
-            args.append('-f')
-            args.append(self.tapeDevice)
-            args.append('bsr')
-            args.append('1')
-            mtStatus, mtOut, mtErr = shared.launchSubProcess(args, False)
+        startTime = time.perf_counter()
+        if self.device.fsf(count):
+            self.file += count
         else:
             # No further files, end of tape reached
             logging.info('*** Reached end of tape ***')
             self.endOfTape = True
+        self.addPhaseTime('positioning', startTime)
+
+    def reportProgress(self, fileBytes):
+        """Put progress report for current file on progressQueue (if there is
+        one); fileBytes is the number of bytes read from the current file"""
+        if self.progressQueue is not None:
+            self.progressQueue.put({'file': self.file,
+                                    'fileBytes': fileBytes,
+                                    'tapeBytes': self.tapeBytes + fileBytes,
+                                    'time': time.perf_counter()})
+
+    def addPhaseTime(self, phase, startTime):
+        """Add time elapsed since startTime (a time.perf_counter value) to
+        the time spent in phase"""
+        self.phaseTimes[phase] = (self.phaseTimes.get(phase, 0.0) +
+                                  time.perf_counter() - startTime)
+
+    def isEndOfData(self, readSuccess, noBytes):
+        """Return True if the result of the first read of a file indicates the
+        end of the tape: either a zero-length read right after a filemark (i.e.
+        two successive filemarks), or a failed read with the EOD or EOT status
+        bit set"""
+
+        if readSuccess:
+            return noBytes == 0 and self.file > 1
+
+        tapeStatus = self.device.status()
+        return tapeStatus is not None and (tapeStatus.eod or tapeStatus.eot)
+
+    def extractFileInternal(self, ofName):
+        """Extract current file to ofName using the built-in reader"""
+
+        bufferSize = self.readBufferSize
+        if self.variableBlockMode:
+            # Each read returns one record, which may be larger than the
+            # first one
+            bufferSize = max(bufferSize, self.maxBlockSize)
+        reader = Reader(self.blockSize, bufferSize, self.fillBlocks, self.bufferCount,
+                        self.writeLimiter, self.hashLimiter, self.codec,
+                        self.compressionWorkers, self.sparseFiles, self.store,
+                        self.chunkSize, self.algorithms)
+        success = reader.readFile(self.device, ofName, self.reportProgress)
+        # Checksum covers all bytes that were written to ofName (before
+        # compression, so it doesn't depend on the codec)
+        for algorithm, digest in reader.digests.items():
+            self.digests[algorithm][shared.imageName(os.path.basename(ofName))] = digest
+        fileMetrics = self.fileMetrics[-1]
+        fileMetrics['bytesRead'] = reader.bytesRead
+        fileMetrics['readCalls'] = reader.readCalls
+        fileMetrics['readErrors'] = reader.readErrors
+        fileMetrics['bytesPadded'] = reader.bytesPadded
+        fileMetrics['readTime'] = reader.readTime
+        fileMetrics['writeTime'] = reader.writeTime
+        fileMetrics['hashTime'] = reader.hashTime
+        if self.codec is not None:
+            fileMetrics['bytesCompressed'] = reader.bytesCompressed
+        if reader.sparse:
+            fileMetrics['bytesSparse'] = reader.bytesSparse
+        if self.store is not None:
+            fileMetrics['chunks'] = reader.chunks
+            fileMetrics['newChunks'] = reader.newChunks
+            fileMetrics['bytesStored'] = reader.bytesStored
+
+        # Mapfile with blocks that were read, filled or not read
+        if reader.map.entries:
+            reader.map.fileNumber = self.file
+            if not reader.map.write(ofName + '.map'):
+                self.successFlag = False
+
+        if not success:
+            self.successFlag = False
+            logging.error('error while reading the tape')
+            # Skip the rest of this file, so that the next file is read from its start
+            if not self.device.fsf(1):
+                logging.error('cannot skip to next file: ' + str(self.device.lastError))
+                self.endOfTape = True
+        elif reader.readErrors != 0:
+            # Unreadable blocks were filled with null bytes
+            self.successFlag = False
+
+    def retryTape(self):
+        """Retry pass: read the blocks that are marked as filled or not read in
+        the mapfiles in dirOut again, and merge any recovered data into the
+        extracted files. Returns False if the tape device is not accessible,
+        True otherwise"""
+
+        logging.info('***************************')
+        logging.info('*** TAPE RETRY PASS LOG ***')
+        logging.info('***************************\n')
+        logging.info('dirOut: ' + self.dirOut)
+        logging.info('tapeDevice: ' + self.tapeDevice)
+
+        self.device = self.createDevice()
+        tapeStatus = self.device.status()
+
+        if tapeStatus is None:
+            self.tapeDeviceIOError = True
+            self.successFlag = False
+            logging.critical('Exiting because tape device is not accessible: ' +
+                             str(self.device.lastError))
+            return False
+
+        logging.info('Tape status: ' + str(tapeStatus))
+        self.originalBlockSize = tapeStatus.blockSize
+
+        # Mapfiles of compressed files and manifests are included as well, so
+        # that they are reported instead of silently ignored
+        mapFiles = sorted(f for f in glob.glob(os.path.join(self.dirOut, self.prefix + '*.' +
+                                                            self.extension + '*.map'))
+                          if shared.imageName(f[:-len('.map')]).endswith('.' + self.extension))
+        if not mapFiles:
+            logging.error('no mapfiles found in ' + self.dirOut)
+            self.successFlag = False
+
+        for mapFileName in mapFiles:
+            fileMap = readMapFile(mapFileName)
+            if fileMap is None:
+                self.successFlag = False
+                continue
+            if fileMap.isComplete():
+                continue
+
+            ofName = mapFileName[:-len('.map')]
+            if shared.imageName(ofName) != ofName:
+                logging.error('cannot retry file # ' + str(fileMap.fileNumber) +
+                              ': compressed files and files in a chunk store cannot ' +
+                              'be updated in place')
+                self.successFlag = False
+                continue
+            logging.info('*** Retrying file # ' + str(fileMap.fileNumber) + ' (' +
+                         str(len(fileMap.badEntries())) + ' regions) ***')
+            newMap, bytesRecovered = self.retryFile(ofName, fileMap)
+            logging.info('bytes recovered: ' + str(bytesRecovered))
+            self.retriedFiles.append(ofName)
+            self.bytesRecovered += bytesRecovered
+
+            if not newMap.write(mapFileName):
+                self.successFlag = False
+            if not newMap.isComplete():
+                self.successFlag = False
+
+        return True
+
+    def retryFile(self, ofName, fileMap):
+        """Read the filled and unread regions of fileMap again, and write any
+        recovered data to ofName in place. Returns (map, bytes recovered) tuple,
+        where map is the updated MapFile"""
+
+        newMap = MapFile(fileMap.fileNumber, fileMap.blockSize, fileMap.driveBlockSize)
+        bytesRecovered = 0
+
+        if not self.device.setBlockSize(fileMap.driveBlockSize):
+            logging.error('cannot set block size: ' + str(self.device.lastError))
+            return fileMap, 0
+
+        try:
+            fOut = io.open(ofName, 'r+b')
+        except OSError as e:
+            logging.error('cannot open ' + ofName + ': ' + str(e))
+            return fileMap, 0
+
+        buffer = bytearray(fileMap.driveBlockSize or max(self.maxBlockSize, fileMap.blockSize))
+
+        with fOut:
+            for block, noBlocks, offset, size, status in fileMap.entries:
+                if status == STATUS_READ:
+                    newMap.add(block, noBlocks, offset, size, status)
+                    continue
+
+                if not self.device.seek(block):
+                    logging.error('cannot position tape at block ' + str(block) + ': ' +
+                                  str(self.device.lastError))
+                    newMap.add(block, noBlocks, offset, size, status)
+                    continue
+
+                if status == STATUS_FILLED:
+                    # Each block must have the size of its padding to fit in place
+                    blockSize = size // noBlocks
+                    noBytes = None
+                    for i in range(noBlocks):
+                        if noBytes == 0:
+                            # Filemark was read, so the rest of this run is not on the tape
+                            newMap.add(block + i, 1, offset + i * blockSize,
+                                       blockSize, STATUS_FILLED)
+                            continue
+                        try:
+                            noBytes = self.device.readinto(buffer)
+                        except OSError as e:
+                            logging.error('read error in block ' + str(block + i) +
+                                          ': ' + str(e))
+                            noBytes = None
+                        if noBytes == blockSize:
+                            fOut.seek(offset + i * blockSize)
+                            fOut.write(buffer[:noBytes])
+                            bytesRecovered += noBytes
+                            newMap.add(block + i, 1, offset + i * blockSize,
+                                       blockSize, STATUS_READ)
+                        else:
+                            if noBytes is not None:
+                                logging.error('block ' + str(block + i) + ' has ' +
+                                              str(noBytes) + ' bytes instead of ' +
+                                              str(blockSize) + ', cannot merge it')
+                            newMap.add(block + i, 1, offset + i * blockSize,
+                                       blockSize, STATUS_FILLED)
+                else:
+                    # Rest of file was not read: read it now, filling blocks
+                    # that still fail
+                    bytesRead = self.retryRestOfFile(fOut, block, offset, fileMap,
+                                                     newMap, buffer)
+                    bytesRecovered += bytesRead
+
+        return newMap, bytesRecovered
+
+    def retryRestOfFile(self, fOut, block, offset, fileMap, newMap, buffer):
+        """Read from block until the next filemark, and write the data to fOut
+        starting at offset. Returns number of bytes read"""
+
+        bytesRead = 0
+        fOut.truncate(offset)
+        fOut.seek(offset)
+        nullBlock = bytes(fileMap.blockSize)
+
+        while True:
+            try:
+                noBytes = self.device.readinto(buffer)
+            except OSError as e:
+                tapeStatus = self.device.status()
+                if tapeStatus is None or tapeStatus.eod or tapeStatus.eot:
+                    logging.error('end of data reached before filemark: ' + str(e))
+                    break
+                logging.error('read error in block ' + str(block) + ': ' + str(e) +
+                              ', filling block with null bytes')
+                fOut.write(nullBlock)
+                newMap.add(block, 1, offset, fileMap.blockSize, STATUS_FILLED)
+                block += 1
+                offset += fileMap.blockSize
+                continue
+
+            if not noBytes:
+                break
+
+            noBlocks = 1
+            if fileMap.driveBlockSize != 0:
+                noBlocks = noBytes // fileMap.driveBlockSize
+            fOut.write(buffer[:noBytes])
+            newMap.add(block, noBlocks, offset, noBytes, STATUS_READ)
+            bytesRead += noBytes
+            block += noBlocks
+            offset += noBytes
+
+        return bytesRead
+
+    def finishRetry(self):
+        """Update checksum and metadata files after a retry pass"""
+
+        metadataFile = os.path.join(self.dirOut, self.metadataFileName)
+
+        try:
+            with io.open(metadataFile, 'r', encoding='utf-8') as f:
+                metadata = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.error('cannot read metadata file: ' + str(e))
+            metadata = None
+
+        logging.info('*** Updating checksum files ***')
+        failedFiles = []
+        if metadata is not None and 'checksums' in metadata:
+            # Update the digests of the retried files, for the algorithms that
+            # were used when the tape was read
+            digests = metadata.get('digests', {})
+            digests[shared.DEFAULT_ALGORITHM] = metadata['checksums']
+            retriedDigests = shared.digestFiles(self.retriedFiles, list(digests),
+                                                self.checksumWorkers, self.hashLimiter,
+                                                failedFiles)
+            for algorithm in digests:
+                digests[algorithm].update(retriedDigests[algorithm])
+        else:
+            allFiles = glob.glob(self.dirOut + "/*." + self.extension)
+            digests = shared.digestFiles(allFiles, self.algorithms, self.checksumWorkers,
+                                         self.hashLimiter, failedFiles)
+        if failedFiles:
+            # Checksums of these files could not be updated
+            self.successFlag = False
+        writeFlag = self.writeChecksumFiles(digests)
+        if not writeFlag:
+            self.successFlag = False
+            logging.error('error while writing checksum file')
+
+        if metadata is not None:
+            logging.info('*** Updating metadata file ***')
+            metadata['checksums'] = digests[shared.DEFAULT_ALGORITHM]
+            metadata['digests'] = digests
+            metadata['successFlag'] = self.successFlag
+            retryPass = {}
+            retryPass['date'] = shared.generateDateTime(self.timeZone)
+            retryPass['files'] = [os.path.basename(f) for f in self.retriedFiles]
+            retryPass['bytesRecovered'] = self.bytesRecovered
+            retryPass['successFlag'] = self.successFlag
+            metadata.setdefault('retryPasses', []).append(retryPass)
+            try:
+                with io.open(metadataFile, 'w', encoding='utf-8') as f:
+                    json.dump(metadata, f, indent=4, sort_keys=True)
+            except IOError:
+                self.successFlag = False
+                logging.error('error while writing metadata file')
+        else:
+            self.successFlag = False
+
+        logging.info('Success: ' + str(self.successFlag))
+
+        if self.successFlag:
+            logging.info('All failed blocks were recovered')
+        else:
+            logging.error('One or more blocks could not be recovered, \
+            check log file for details')
+
+    def extractFileDd(self, ofName):
+        """Extract current file to ofName using dd (fallback)"""
+
+        # dd needs exclusive access to the device
+        self.device.close()
+
+        args = ['dd']
+        args.append('if=' + self.tapeDevice)
+        args.append('of='+ ofName)
+        args.append('bs=' + str(self.blockSize))
+
+        if self.fillBlocks:
+            # Add conv=noerror,sync options to argument list
+            args.append('conv=noerror,sync')
+
+        # dd doesn't report progress, so watch the size of the output file
+        ddFinished = threading.Event()
+        watcher = None
+        if self.progressQueue is not None:
+            watcher = threading.Thread(target=self.watchOutputFile,
+                                       args=(ofName, ddFinished),
+                                       name=threading.current_thread().name + '-progress')
+            watcher.start()
+
+        startTime = time.perf_counter()
+        self.subProcessCount += 1
+        ddStatus, ddOut, ddErr = shared.launchSubProcess(args, stream=True)
+        elapsedTime = time.perf_counter() - startTime
+
+        ddFinished.set()
+        if watcher is not None:
+            watcher.join()
+        self.subProcessTime += elapsedTime
+
+        # dd reads and writes at the same time; hashing is done afterwards
+        fileMetrics = self.fileMetrics[-1]
+        try:
+            fileMetrics['bytesRead'] = os.path.getsize(ofName)
+        except OSError:
+            fileMetrics['bytesRead'] = 0
+        fileMetrics['readTime'] = elapsedTime
+
+        if ddStatus != 0:
+            self.successFlag = False
+            logging.error('dd encountered an error while reading the tape')
+
+    def watchOutputFile(self, ofName, finished):
+        """Report size of ofName as progress until finished is set"""
+        while True:
+            isFinished = finished.wait(PROGRESS_INTERVAL)
+            try:
+                self.reportProgress(os.path.getsize(ofName))
+            except OSError:
+                pass
+            if isFinished:
+                break
 
     def findBlockSize(self):
         """Find block size, starting from blockSizeInit"""
 
-        # Set blockSize to initBlockSize
-        self.blockSize = self.initBlockSize
-        # Flag that indicates block size was found
-        blockSizeFound = False
-
-        while not blockSizeFound:
-            # Try reading 1 block from tape
-            logging.info('*** Guessing block size for file # ' +
-                         str(self.file)  + ', trial value ' +
-                         str(self.blockSize) + ' ***')
-
-            args = ['dd']
-            args.append('if=' + self.tapeDevice)
-            args.append('of=/dev/null')
-            args.append('bs=' + str(self.blockSize))
-            args.append('count=1')
-            ddStatus, ddOut, ddErr = shared.launchSubProcess(args, False)
-
-            # Position tape 1 record backward (i.e. to the start of this file)
-            args = ['mt']
-            args.append('-f')
-            args.append(self.tapeDevice)
-            args.append('bsr')
-            args.append('1')
-            mtStatus, mtOut, mtErr = shared.launchSubProcess(args, False)
-
-            if ddStatus == 0:
-                # Block size found
-                blockSizeFound = True
+        self.blockSizeProbes = []
+
+        if self.variableBlockMode and self.findBlockSizeVariable():
+            return
+
+        if self.endOfTape:
+            return
+
+        # Probes rely on the property that a read with a block size that is too
+        # small fails, whereas any block size that is large enough succeeds.
+        # First double the trial value until a read succeeds, then narrow down
+        # to the smallest multiple of 512 that works using a binary search.
+
+        # Largest value known to fail (or lower bound), smallest value known to work
+        lower = self.initBlockSize - 512
+        upper = None
+
+        trialSize = self.initBlockSize
+        while upper is None and lower < self.maxBlockSize:
+            trialSize = min(trialSize, self.maxBlockSize)
+            if self.probeBlockSize(trialSize):
+                upper = trialSize
+            elif self.endOfTape:
+                return
             else:
-                # Try again with larger block size
-                self.blockSize += 512
+                lower = trialSize
+                trialSize *= 2
+
+        if upper is None:
+            logging.error('No block size up to ' + str(self.maxBlockSize) +
+                          ' results in a successful read')
+            self.blockSize = self.maxBlockSize
+        else:
+            while upper - lower > 512:
+                trialSize = ((lower + upper) // 1024) * 512
+                if self.probeBlockSize(trialSize):
+                    upper = trialSize
+                else:
+                    lower = trialSize
+            self.blockSize = upper
+
+        logging.info('Block size probes: ' + str(len(self.blockSizeProbes)) +
+                     ', sequence: ' + ', '.join([str(i) for i in self.blockSizeProbes]))
+
+    def probeBlockSize(self, trialSize):
+        """Try reading 1 block of trialSize bytes from the tape, and position
+        the tape back to the start of the file. Returns True if the read
+        succeeded, False otherwise"""
+
+        logging.info('*** Guessing block size for file # ' +
+                     str(self.file)  + ', trial value ' +
+                     str(trialSize) + ' ***')
+
+        self.blockSizeProbes.append(trialSize)
+
+        # Equivalent of dd bs=trialSize count=1
+        readSuccess, recordSize = readRecordSize(self.device, trialSize)
+
+        # Only the first read of a file can detect the end of the tape (if a
+        # variable block mode read was tried first, that one already did)
+        if len(self.blockSizeProbes) == 1 and self.isEndOfData(readSuccess, recordSize):
+            # Nothing was read, so no need to reposition the tape
+            self.endOfTape = True
+            return False
+
+        # Position tape 1 record backward (i.e. to the start of this file)
+        self.device.bsr(1)
+
+        return readSuccess
+
+    def findBlockSizeVariable(self):
+        """Find block size by switching the drive to variable block mode
+        and reading one record with a buffer of maxBlockSize bytes. Returns
+        True if this worked, False otherwise"""
+
+        logging.info('*** Reading first record of file # ' + str(self.file) +
+                     ' in variable block mode ***')
+
+        if not self.device.setBlockSize(0):
+            logging.info('Cannot switch drive to variable block mode')
+            self.variableBlockMode = False
+            return False
+
+        self.blockSizeProbes.append(self.maxBlockSize)
+        readSuccess, recordSize = readRecordSize(self.device, self.maxBlockSize)
+
+        if self.isEndOfData(readSuccess, recordSize):
+            # Nothing was read, so no need to reposition the tape
+            self.endOfTape = True
+            return False
+
+        if readSuccess and recordSize == 0:
+            # Filemark, so this file is empty. Position tape before the filemark
+            self.device.bsf(1)
+            self.blockSize = self.initBlockSize
+            return True
+
+        # Position tape 1 record backward (i.e. to the start of this file)
+        self.device.bsr(1)
+
+        if not readSuccess:
+            logging.info('Variable block read failed, falling back to block size probing')
+            return False
+
+        self.blockSize = recordSize
+        return True
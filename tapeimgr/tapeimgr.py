@@ -7,18 +7,25 @@ Research department,  KB / National Library of the Netherlands
 """
 import sys
 from .cli import main as cliLaunch
-from .gui import main as guiLaunch
+from .verify import main as verifyLaunch
+from .version import __version__
 from . import config
 
-__version__ = '0.5.0'
 
 def main():
-    """Launch GUI if no command line arguments were given; otherwise launch CLI"""
+    """Launch GUI if no command line arguments were given, verification of
+    existing output directories for the verify subcommand, and CLI otherwise"""
     config.version = __version__
     noArgs = len(sys.argv)
     if noArgs == 1:
+        # Imported here, so the command-line modes work without tkinter and
+        # tkfilebrowser
+        from .gui import main as guiLaunch
         guiLaunch()
+    elif sys.argv[1] == 'verify':
+        verifyLaunch(sys.argv[2:])
     else:
         cliLaunch()
 
-main()
+if __name__ == "__main__":
+    main()
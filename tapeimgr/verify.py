@@ -0,0 +1,252 @@
+#! /usr/bin/env python3
+"""
+Tapeimgr, automated reading of tape
+Verify: checks the extracted files in existing output directories against
+their checksum and metadata files
+
+Author: Johan van der Knijff
+Research department,  KB / National Library of the Netherlands
+"""
+
+import os
+import io
+import sys
+import json
+import glob
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from .tape import Tape
+from .chunkstore import readManifest, MANIFEST_EXTENSION
+from .version import __version__
+from . import shared
+
+
+def hashFile(path, algorithms):
+    """Return digests of file at path for list of algorithms and number of
+    bytes read from disk, or None and an error message if the file cannot be
+    read (e.g. a damaged compressed file, or a manifest with missing chunks)"""
+    try:
+        if path.endswith('.' + MANIFEST_EXTENSION):
+            noBytes = readManifest(path)['size']
+        else:
+            noBytes = os.path.getsize(path)
+        return shared.generate_file_digests(path, algorithms), noBytes
+    except shared.READ_ERRORS as e:
+        return None, str(e)
+
+
+def verifyDirectory(dirOut, checksumFileName, metadataFileName, workers=0, allDigests=False):
+    """Re-hash the extracted files in dirOut, and compare them against the
+    checksum file and the metadata file. If allDigests is True, the digests of
+    all algorithms in the metadata file are checked, otherwise only SHA-512.
+    Returns dictionary with results"""
+
+    results = {}
+    results['dirOut'] = dirOut
+    results['ok'] = []
+    results['mismatched'] = []
+    results['missing'] = []
+    results['extra'] = []
+    results['errors'] = []
+    results['bytes'] = 0
+    results['time'] = 0.0
+
+    checksums = {}
+    try:
+        checksums = shared.readChecksums(os.path.join(dirOut, checksumFileName))
+    except (OSError, ValueError) as e:
+        results['errors'].append('cannot read checksum file: ' + str(e))
+
+    metadata = {}
+    try:
+        with io.open(os.path.join(dirOut, metadataFileName), 'r', encoding='utf-8') as f:
+            metadata = json.load(f)
+    except (OSError, ValueError) as e:
+        results['errors'].append('cannot read metadata file: ' + str(e))
+
+    # Expected digests; files that are only listed in the metadata file are
+    # checked as well, and files for which both files disagree are reported
+    digests = {shared.DEFAULT_ALGORITHM: dict(checksums)}
+    disagree = set()
+    for fName, hashString in metadata.get('checksums', {}).items():
+        if fName not in checksums:
+            results['errors'].append(fName + ' is not listed in checksum file')
+            digests[shared.DEFAULT_ALGORITHM][fName] = hashString
+        elif checksums[fName] != hashString:
+            results['errors'].append('checksum file and metadata file disagree on ' + fName)
+            disagree.add(fName)
+    if allDigests:
+        for algorithm, fileDigests in metadata.get('digests', {}).items():
+            if algorithm != shared.DEFAULT_ALGORITHM:
+                digests[algorithm] = fileDigests
+
+    # Locate files on disk (they may be compressed, or in a chunk store)
+    fNames = sorted(set(fName for algorithm in digests for fName in digests[algorithm]))
+    paths = []
+    for fName in fNames:
+        path = shared.findImage(dirOut, fName)
+        if path is None:
+            results['missing'].append(fName)
+        else:
+            paths.append(path)
+
+    # Extracted files that aren't listed anywhere
+    prefix = metadata.get('prefix', '')
+    extension = metadata.get('extension', '')
+    if extension:
+        for path in glob.glob(os.path.join(dirOut, prefix + '*.' + extension + '*')):
+            fName = shared.imageName(os.path.basename(path))
+            if fName.endswith('.' + extension) and fName not in fNames:
+                results['extra'].append(os.path.basename(path))
+        results['extra'].sort()
+
+    # Files are read sequentially in large blocks, and hashed in parallel
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    algorithms = list(digests)
+    startTime = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        hashed = list(executor.map(lambda path: hashFile(path, algorithms), paths))
+    results['time'] = time.perf_counter() - startTime
+
+    computed = {}
+    for path, (hexDigests, info) in zip(paths, hashed):
+        fName = shared.imageName(os.path.basename(path))
+        if hexDigests is None:
+            results['errors'].append('cannot read ' + os.path.basename(path) + ': ' + info)
+        else:
+            results['bytes'] += info
+        computed[fName] = hexDigests or {}
+
+    for fName in fNames:
+        if fName in results['missing']:
+            continue
+        failed = [algorithm for algorithm in digests if fName in digests[algorithm] and
+                  computed[fName].get(algorithm) != digests[algorithm][fName].lower()]
+        if failed or fName in disagree:
+            results['mismatched'].append({'file': fName, 'algorithms': failed})
+        else:
+            results['ok'].append(fName)
+
+    return results
+
+
+def printResults(results, quiet=False):
+    """Print results of verifyDirectory for each file to stdout, and a summary
+    to stderr"""
+
+    if not quiet:
+        for fName in results['ok']:
+            sys.stdout.write(os.path.join(results['dirOut'], fName) + ': OK\n')
+    for item in results['mismatched']:
+        sys.stdout.write(os.path.join(results['dirOut'], item['file']) + ': FAILED' +
+                         (' (' + ', '.join(item['algorithms']) + ')'
+                          if item['algorithms'] else '') + '\n')
+    for fName in results['missing']:
+        sys.stdout.write(os.path.join(results['dirOut'], fName) + ': MISSING\n')
+    for fName in results['extra']:
+        sys.stdout.write(os.path.join(results['dirOut'], fName) + ': EXTRA\n')
+    for error in results['errors']:
+        sys.stderr.write('ERROR: ' + results['dirOut'] + ': ' + error + '\n')
+
+    throughput = 0.0
+    if results['time'] > 0:
+        throughput = results['bytes'] / results['time'] / 1e6
+    sys.stderr.write('INFO: ' + results['dirOut'] + ': ' +
+                     str(len(results['ok'])) + ' OK, ' +
+                     str(len(results['mismatched'])) + ' failed, ' +
+                     str(len(results['missing'])) + ' missing, ' +
+                     str(len(results['extra'])) + ' extra; ' +
+                     str(results['bytes']) + ' bytes in ' +
+                     '{:.1f}'.format(results['time']) + ' s (' +
+                     '{:.1f}'.format(throughput) + ' MB/s)\n')
+
+
+def parseCommandLine(parser, args):
+    """Parse command line"""
+
+    parser.add_argument('dirsOut',
+                        action='store',
+                        type=str,
+                        nargs='+',
+                        help='output directory (or directories) of earlier runs')
+    parser.add_argument('--version', '-v',
+                        action='version',
+                        version=__version__)
+    parser.add_argument('--workers', '-w',
+                        action='store',
+                        type=int,
+                        dest='workers',
+                        default=None,
+                        help='number of files that are hashed in parallel (default: '
+                        'checksumWorkers in configuration file)')
+    parser.add_argument('--all', '-a',
+                        action='store_true',
+                        dest='allDigests',
+                        default=False,
+                        help='check the digests of all algorithms in the metadata file '
+                        '(default: SHA-512 only)')
+    parser.add_argument('--report', '-r',
+                        action='store',
+                        type=str,
+                        dest='report',
+                        default='',
+                        help='write results to this file in JSON format')
+    parser.add_argument('--quiet', '-q',
+                        action='store_true',
+                        dest='quiet',
+                        default=False,
+                        help='only report files that failed')
+    # Parse arguments
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    """Main verify application; args is the list of command-line arguments
+    after the verify subcommand"""
+
+    parser = argparse.ArgumentParser(prog='tapeimgr verify',
+                                     description='Check the extracted files in existing '
+                                     'output directories against their checksum and '
+                                     'metadata files')
+    args = parseCommandLine(parser, args)
+
+    # File names and number of workers from configuration file
+    tape = Tape()
+    tape.getConfiguration()
+    checksumFileName = tape.checksumFileName or 'checksums.sha512'
+    metadataFileName = tape.metadataFileName or 'metadata.json'
+    workers = args.workers
+    if workers is None:
+        workers = tape.checksumWorkers
+
+    report = []
+    success = True
+    for dirOut in args.dirsOut:
+        if not os.path.isdir(dirOut):
+            sys.stderr.write("ERROR: output directory '" + dirOut + "' doesn't exist\n")
+            success = False
+            continue
+        results = verifyDirectory(dirOut, checksumFileName, metadataFileName, workers,
+                                  args.allDigests)
+        printResults(results, args.quiet)
+        report.append(results)
+        if (results['mismatched'] or results['missing'] or results['extra'] or
+                results['errors']):
+            success = False
+
+    if args.report:
+        try:
+            with io.open(args.report, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=4, sort_keys=True)
+        except OSError as e:
+            sys.stderr.write('ERROR: cannot write report: ' + str(e) + '\n')
+            success = False
+
+    if not success:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+#! /usr/bin/env python3
+"""Version number of tapeimgr; kept in a separate module, so that the
+command-line tools can use it without importing the GUI"""
+
+__version__ = '0.5.0'
@@ -0,0 +1,164 @@
+#! /usr/bin/env python3
+"""This module contains the VirtualBackend class, which simulates a tape
+that is described by a JSON file on disk. This allows tapeimgr to be run
+(and tested) without a tape drive, by using a tape device name of the form
+vtape:/path/to/description.json
+
+Example description:
+
+{
+    "files": [
+        {"data": "tar1.tar", "recordSize": 10240},
+        {"records": [{"size": 65536, "count": 100, "pattern": "random"},
+                     {"size": 512, "count": 1, "pattern": "zero"}]}
+    ],
+    "errors": [
+        {"file": 2, "record": 10, "count": 1, "failures": -1}
+    ]
+}
+
+Each file is either read from a data file (path relative to the description
+file), which is split into records of recordSize bytes (the last record may
+be shorter), or generated from a list of record groups. Generated records
+are filled with null bytes (pattern "zero"), or with pseudo-random bytes
+(pattern "random", default). Errors inject read errors for count records,
+starting at record number record of file number file (both counted from
+1). Failures is the number of read attempts that fail before the records
+can be read; -1 (default) means they never can.
+"""
+
+import os
+import io
+import json
+import errno
+import random
+from .mtio import SimulatedBackend
+
+VIRTUAL_PREFIX = 'vtape:'
+
+
+def isVirtualDevice(deviceName):
+    """Return True if deviceName refers to a virtual tape"""
+    return deviceName.startswith(VIRTUAL_PREFIX)
+
+
+class DataFileRecords:
+    """Sequence of records that are read from a data file on demand"""
+
+    def __init__(self, dataFile, recordSize):
+        """initialise DataFileRecords class instance"""
+        self.dataFile = dataFile
+        self.recordSize = recordSize
+        self.fileSize = os.path.getsize(dataFile)
+        self.fd = None
+
+    def __len__(self):
+        return (self.fileSize + self.recordSize - 1) // self.recordSize
+
+    def __getitem__(self, index):
+        if self.fd is None:
+            self.fd = os.open(self.dataFile, os.O_RDONLY)
+        return os.pread(self.fd, self.recordSize, index * self.recordSize)
+
+    def close(self):
+        """Close data file"""
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class GeneratedRecords:
+    """Sequence of generated records, made up of groups of equally sized
+    records. All records within a group have the same content"""
+
+    def __init__(self, groups, seed):
+        """initialise GeneratedRecords class instance"""
+        # List of (first record index, count, content) tuples
+        self.groups = []
+        self.noRecords = 0
+        generator = random.Random(seed)
+        for group in groups:
+            size = int(group['size'])
+            count = int(group.get('count', 1))
+            if group.get('pattern', 'random') == 'zero':
+                content = bytes(size)
+            else:
+                content = generator.getrandbits(8 * size).to_bytes(size, 'little')
+            self.groups.append((self.noRecords, count, content))
+            self.noRecords += count
+
+    def __len__(self):
+        return self.noRecords
+
+    def __getitem__(self, index):
+        for first, count, content in self.groups:
+            if first <= index < first + count:
+                return content
+        raise IndexError('record index out of range')
+
+    def close(self):
+        """Nothing to close"""
+
+
+class VirtualBackend(SimulatedBackend):
+    """Backend that simulates the tape described by descriptionFile. The
+    description is read when the device is opened"""
+
+    def __init__(self, descriptionFile):
+        """initialise VirtualBackend class instance"""
+        super().__init__([])
+        self.descriptionFile = descriptionFile
+        self.described = False
+
+    def open(self):
+        """Open the device, and read the tape description on first use"""
+        if not self.described:
+            try:
+                self.readDescription()
+            except (IOError, ValueError, KeyError, TypeError) as e:
+                raise OSError(errno.ENODEV, 'invalid virtual tape description ' +
+                              self.descriptionFile + ': ' + str(e))
+            self.described = True
+        super().open()
+
+    def readDescription(self):
+        """Read tape description from file"""
+        with io.open(self.descriptionFile, 'r', encoding='utf-8') as f:
+            description = json.load(f)
+
+        baseDir = os.path.dirname(os.path.abspath(self.descriptionFile))
+        files = []
+        for i, fileDict in enumerate(description['files']):
+            if 'data' in fileDict:
+                dataFile = os.path.join(baseDir, fileDict['data'])
+                files.append(DataFileRecords(dataFile, int(fileDict['recordSize'])))
+            else:
+                files.append(GeneratedRecords(fileDict['records'], i))
+        self.files = files
+
+        self.badRecords = {}
+        for errorDict in description.get('errors', []):
+            fileIndex = int(errorDict['file']) - 1
+            recordIndex = int(errorDict['record']) - 1
+            for j in range(int(errorDict.get('count', 1))):
+                self.badRecords[(fileIndex, recordIndex + j)] = int(errorDict.get('failures', -1))
+
+    def closeRecords(self):
+        """Close any open data files"""
+        for records in self.files:
+            records.close()
+
+    def unloadTape(self):
+        """Remove the tape from the drive"""
+        self.closeRecords()
+        super().unloadTape()
+
+    def close(self):
+        """Close the device and any open data files"""
+        self.closeRecords()
+        super().close()
+
+
+def createBackend(deviceName):
+    """Return VirtualBackend instance for virtual device name"""
+    return VirtualBackend(deviceName[len(VIRTUAL_PREFIX):])
@@ -0,0 +1,72 @@
+#! /usr/bin/env python3
+"""Tests for queue mode with a simulated media changer"""
+
+import os
+import io
+import shutil
+import hashlib
+import tempfile
+import unittest
+from tapeimgr.changer import TapeQueue, SimulatedChanger
+from tapeimgr.mtio import SimulatedBackend
+
+# Tape settings (normally read from the configuration file)
+TAPE_SETTINGS = {'files': '',
+                 'checksumFileName': 'checksums.sha512',
+                 'logFileName': 'tapeimgr.log',
+                 'metadataFileName': 'metadata.json',
+                 'initBlockSize': '512',
+                 'prefix': 'file',
+                 'extension': 'dd',
+                 'fillBlocks': False,
+                 'timeZone': 'Europe/Amsterdam'}
+
+
+class TapeQueueTest(unittest.TestCase):
+    """Two tapes, each read into its own subdirectory"""
+
+    def setUp(self):
+        self.dirOut = tempfile.mkdtemp()
+        self.tapes = {}
+        for slot, barcode in [(1, 'TAPE01'), (3, 'TAPE02')]:
+            files = [[bytes([slot, i, j]) * 1024 for j in range(4)] for i in range(2)]
+            self.tapes[slot] = (barcode, files)
+        self.backend = SimulatedBackend([])
+        self.changer = SimulatedChanger(self.tapes, self.backend)
+
+    def tearDown(self):
+        shutil.rmtree(self.dirOut)
+
+    def testRun(self):
+        queue = TapeQueue(self.changer, 0, 'simulated', self.dirOut, self.backend,
+                          loadTimeout=5)
+        queue.tapeSettings = TAPE_SETTINGS
+        inventory = self.changer.inventory()
+        results = queue.run([(inventory[barcode], barcode) for barcode in ['TAPE01', 'TAPE02']])
+
+        self.assertEqual(results, {'TAPE01': True, 'TAPE02': True})
+        # Last tape was put back
+        self.assertFalse(self.backend.loaded)
+        for slot, (barcode, files) in self.tapes.items():
+            dirOut = os.path.join(self.dirOut, barcode)
+            with io.open(os.path.join(dirOut, 'checksums.sha512'), 'r', encoding='utf-8') as f:
+                checksums = dict(reversed(line.split()) for line in f)
+            self.assertEqual(len(checksums), len(files))
+            for i, records in enumerate(files):
+                fName = 'file' + str(i + 1).zfill(6) + '.dd'
+                data = b''.join(records)
+                with open(os.path.join(dirOut, fName), 'rb') as f:
+                    self.assertEqual(f.read(), data)
+                self.assertEqual(checksums[fName], hashlib.sha512(data).hexdigest())
+
+    def testLoadFailure(self):
+        queue = TapeQueue(self.changer, 0, 'simulated', self.dirOut, self.backend,
+                          loadTimeout=0)
+        queue.tapeSettings = TAPE_SETTINGS
+        results = queue.run([(2, 'EMPTY'), (3, 'TAPE02')])
+        self.assertEqual(results, {'EMPTY': False, 'TAPE02': True})
+        self.assertFalse(os.path.exists(os.path.join(self.dirOut, 'EMPTY')))
+
+
+if __name__ == '__main__':
+    unittest.main()
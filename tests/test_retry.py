@@ -0,0 +1,55 @@
+#! /usr/bin/env python3
+"""Tests for the retry pass"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from tapeimgr.tape import Tape
+from tapeimgr.mtio import SimulatedBackend
+from tapeimgr.mapfile import MapFile, STATUS_READ, STATUS_FILLED
+
+
+class RetryTest(unittest.TestCase):
+    """Retry pass on output directories with compressed files and manifests"""
+
+    def setUp(self):
+        self.dirOut = tempfile.mkdtemp()
+        self.tape = Tape()
+        self.tape.dirOut = self.dirOut
+        self.tape.tapeDevice = 'simulated'
+        self.tape.deviceBackend = SimulatedBackend([[bytes(512)] * 4])
+        self.tape.prefix = 'file'
+        self.tape.extension = 'dd'
+
+    def tearDown(self):
+        shutil.rmtree(self.dirOut)
+
+    def writeIncompleteMap(self, fName):
+        """Write fName and a mapfile for it with a filled block"""
+        with open(os.path.join(self.dirOut, fName), 'wb') as f:
+            f.write(b'data')
+        fileMap = MapFile(1, 512, 512)
+        fileMap.add(0, 3, 0, 1536, STATUS_READ)
+        fileMap.add(3, 1, 1536, 512, STATUS_FILLED)
+        fileMap.write(os.path.join(self.dirOut, fName + '.map'))
+
+    def assertNotRetried(self, fName):
+        """Retry pass must report fName as a file that cannot be updated"""
+        self.writeIncompleteMap(fName)
+        with self.assertLogs(level='ERROR') as logs:
+            self.assertTrue(self.tape.retryTape())
+        self.assertFalse(self.tape.successFlag)
+        self.assertEqual(self.tape.retriedFiles, [])
+        self.assertTrue(any('cannot be updated in place' in line for line in logs.output))
+        self.assertFalse(any('no mapfiles found' in line for line in logs.output))
+
+    def testCompressedFile(self):
+        self.assertNotRetried('file000001.dd.gz')
+
+    def testManifest(self):
+        self.assertNotRetried('file000001.dd.manifest')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,288 @@
+#! /usr/bin/env python3
+"""Tests for reading virtual tapes (vtape:) with the Tape class"""
+
+import os
+import io
+import json
+import random
+import shutil
+import hashlib
+import tempfile
+import unittest
+from tapeimgr.tape import Tape
+from tapeimgr.journal import Journal
+from tapeimgr.mapfile import readMapFile
+from tapeimgr.planner import FilePlanner, parseFileRanges
+from tapeimgr.virtualtape import createBackend, VIRTUAL_PREFIX
+
+# Settings as written by tapeimgr-config
+CONFIG = {'files': '',
+          'checksumFileName': 'checksums.sha512',
+          'logFileName': 'tapeimgr.log',
+          'metadataFileName': 'metadata.json',
+          'tapeDevice': '/dev/nst0',
+          'initBlockSize': '512',
+          'prefix': 'file',
+          'extension': 'dd',
+          'fillBlocks': 'False',
+          'timeZone': 'Europe/Amsterdam',
+          'defaultDir': ''}
+
+RECORD_SIZE = 4096
+
+
+class TapeTest(unittest.TestCase):
+    """Base class: a virtual tape with files made from data files on disk"""
+
+    # Number of records in each file on the tape
+    fileRecords = [8, 3, 5]
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.dirOut = os.path.join(self.tempDir, 'out')
+        os.mkdir(self.dirOut)
+        self.configFile = os.path.join(self.tempDir, 'tapeimgr.json')
+        with io.open(self.configFile, 'w', encoding='utf-8') as f:
+            json.dump(CONFIG, f)
+        generator = random.Random(1)
+        self.sourceData = []
+        for i, noRecords in enumerate(self.fileRecords):
+            data = generator.getrandbits(8 * noRecords * RECORD_SIZE).to_bytes(
+                noRecords * RECORD_SIZE, 'little')
+            with open(os.path.join(self.tempDir, 'data' + str(i + 1)), 'wb') as f:
+                f.write(data)
+            self.sourceData.append(data)
+        self.writeDescription([])
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def writeDescription(self, errors):
+        """Write virtual tape description with list of injected errors"""
+        description = {'files': [{'data': 'data' + str(i + 1), 'recordSize': RECORD_SIZE}
+                                 for i in range(len(self.fileRecords))],
+                       'errors': errors}
+        self.description = os.path.join(self.tempDir, 'tape.json')
+        with io.open(self.description, 'w', encoding='utf-8') as f:
+            json.dump(description, f)
+
+    def createTape(self, **settings):
+        """Return validated Tape instance for the virtual tape"""
+        tape = Tape()
+        tape.configFile = self.configFile
+        tape.getConfiguration()
+        self.assertTrue(tape.configSuccess)
+        tape.tapeDevice = VIRTUAL_PREFIX + self.description
+        tape.dirOut = self.dirOut
+        for attribute, value in settings.items():
+            setattr(tape, attribute, value)
+        tape.validateInput()
+        self.assertTrue(tape.deviceAccessibleFlag)
+        return tape
+
+    def outputPath(self, fileNumber):
+        """Return path of extracted file fileNumber"""
+        return os.path.join(self.dirOut, 'file' + str(fileNumber).zfill(6) + '.dd')
+
+    def readChecksums(self):
+        """Return dictionary with checksums from checksum file"""
+        checksums = {}
+        with io.open(os.path.join(self.dirOut, 'checksums.sha512'), 'r',
+                     encoding='utf-8') as f:
+            for line in f:
+                hashString, fName = line.split()
+                checksums[fName] = hashString
+        return checksums
+
+    def readMetadata(self):
+        """Return contents of metadata file"""
+        with io.open(os.path.join(self.dirOut, 'metadata.json'), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+
+class ExtractTest(TapeTest):
+    """Extraction of a tape without errors"""
+
+    def testChecksumsMatchSource(self):
+        tape = self.createTape()
+        tape.processTape()
+        self.assertTrue(tape.successFlag)
+        self.assertTrue(tape.finishedFlag)
+
+        checksums = self.readChecksums()
+        self.assertEqual(len(checksums), len(self.sourceData))
+        for i, data in enumerate(self.sourceData):
+            with open(self.outputPath(i + 1), 'rb') as f:
+                self.assertEqual(f.read(), data)
+            fName = os.path.basename(self.outputPath(i + 1))
+            self.assertEqual(checksums[fName], hashlib.sha512(data).hexdigest())
+        self.assertEqual(self.readMetadata()['checksums'], checksums)
+
+    def testFileRange(self):
+        tape = self.createTape(files='2-3')
+        tape.processTape()
+        self.assertTrue(tape.successFlag)
+        self.assertFalse(os.path.exists(self.outputPath(1)))
+        for fileNumber in [2, 3]:
+            with open(self.outputPath(fileNumber), 'rb') as f:
+                self.assertEqual(f.read(), self.sourceData[fileNumber - 1])
+        self.assertEqual(sorted(self.readChecksums()), ['file000002.dd', 'file000003.dd'])
+
+
+class VariableRecordTest(TapeTest):
+    """Extraction of a file with records that are larger than the first
+    record, and not a multiple of its size"""
+
+    def testLargerRecords(self):
+        description = {'files': [{'records': [{'size': 3000, 'count': 1},
+                                              {'size': 5000, 'count': 2}]}]}
+        with io.open(self.description, 'w', encoding='utf-8') as f:
+            json.dump(description, f)
+        tape = self.createTape(readBufferSize=1000, maxBlockSize=5000)
+        tape.processTape()
+        self.assertTrue(tape.successFlag)
+        self.assertEqual(os.path.getsize(self.outputPath(1)), 13000)
+
+
+class PlannerTest(unittest.TestCase):
+    """Selection of files"""
+
+    def testParseFileRanges(self):
+        self.assertEqual(parseFileRanges(''), [])
+        self.assertEqual(parseFileRanges('5,1-3,4'), [[1, 5]])
+        self.assertEqual(parseFileRanges('2,7-,9'), [[2, 2], [7, None]])
+        for files in ['0', '3-1', 'a', '1,,2']:
+            with self.assertRaises(ValueError):
+                parseFileRanges(files)
+
+    def testSkipCount(self):
+        planner = FilePlanner(parseFileRanges('3-4,8'))
+        self.assertEqual(planner.skipCount(1), 2)
+        self.assertEqual(planner.skipCount(3), 0)
+        self.assertEqual(planner.skipCount(5), 3)
+        self.assertIsNone(planner.skipCount(9))
+        planner.completedFiles = {3, 4}
+        self.assertEqual(planner.skipCount(1), 7)
+
+
+class BadRecordTest(TapeTest):
+    """Extraction of a tape with a record that can't be read (record 3 of
+    file 1, which is block 2 of the map)"""
+
+    def setUp(self):
+        super().setUp()
+        self.writeDescription([{'file': 1, 'record': 3, 'count': 1, 'failures': -1}])
+
+    def testWithoutFill(self):
+        tape = self.createTape(fillBlocks=False)
+        tape.processTape()
+        self.assertFalse(tape.successFlag)
+
+        # Reading of file 1 stopped at the bad record
+        fileMap = readMapFile(self.outputPath(1) + '.map')
+        self.assertEqual(fileMap.entries, [[0, 2, 0, 2 * RECORD_SIZE, '+'],
+                                           [2, 0, 2 * RECORD_SIZE, 0, '?']])
+        with open(self.outputPath(1), 'rb') as f:
+            self.assertEqual(f.read(), self.sourceData[0][:2 * RECORD_SIZE])
+
+    def testWithFill(self):
+        tape = self.createTape(fillBlocks=True)
+        tape.processTape()
+        self.assertFalse(tape.successFlag)
+
+        fileMap = readMapFile(self.outputPath(1) + '.map')
+        self.assertEqual(fileMap.entries, [[0, 2, 0, 2 * RECORD_SIZE, '+'],
+                                           [2, 1, 2 * RECORD_SIZE, RECORD_SIZE, '-'],
+                                           [3, 5, 3 * RECORD_SIZE, 5 * RECORD_SIZE, '+']])
+        expected = bytearray(self.sourceData[0])
+        expected[2 * RECORD_SIZE:3 * RECORD_SIZE] = bytes(RECORD_SIZE)
+        with open(self.outputPath(1), 'rb') as f:
+            self.assertEqual(f.read(), bytes(expected))
+        # Other files are not affected
+        with open(self.outputPath(2), 'rb') as f:
+            self.assertEqual(f.read(), self.sourceData[1])
+
+
+class RetryPassTest(TapeTest):
+    """Retry pass that recovers a record that failed once"""
+
+    def setUp(self):
+        super().setUp()
+        self.writeDescription([{'file': 1, 'record': 3, 'count': 1, 'failures': 1}])
+
+    def testRetryRecoversBlock(self):
+        # The drive keeps its state between the runs, so the second attempt
+        # to read the record succeeds
+        backend = createBackend(VIRTUAL_PREFIX + self.description)
+        tape = self.createTape(fillBlocks=True, deviceBackend=backend)
+        tape.processTape()
+        self.assertFalse(tape.successFlag)
+        self.assertEqual(len(readMapFile(self.outputPath(1) + '.map').badEntries()), 1)
+
+        backend.loadTape(backend.files)
+        tape = self.createTape(deviceBackend=backend, retryMode=True)
+        tape.processTape()
+        self.assertTrue(tape.successFlag)
+        self.assertEqual(tape.retriedFiles, [self.outputPath(1)])
+
+        fileMap = readMapFile(self.outputPath(1) + '.map')
+        self.assertTrue(fileMap.isComplete())
+        with open(self.outputPath(1), 'rb') as f:
+            self.assertEqual(f.read(), self.sourceData[0])
+        fName = os.path.basename(self.outputPath(1))
+        self.assertEqual(self.readChecksums()[fName],
+                         hashlib.sha512(self.sourceData[0]).hexdigest())
+        self.assertEqual(len(self.readMetadata()['retryPasses']), 1)
+
+
+class ResumeTest(TapeTest):
+    """Resuming a run that was interrupted after the first two files"""
+
+    def testResume(self):
+        tape = self.createTape()
+        tape.processTape()
+        self.assertTrue(tape.successFlag)
+
+        # Simulate the interruption: the journal only lists the first two
+        # files, and the third file and the final output files don't exist
+        journal = Journal(tape.journalFile)
+        self.assertTrue(journal.read())
+        entries = journal.entries
+        journal.start(journal.header)
+        for entry in entries[:2]:
+            journal.append(entry)
+        for fName in ['file000003.dd', 'file000003.dd.map', 'checksums.sha512',
+                      'metadata.json']:
+            os.remove(os.path.join(self.dirOut, fName))
+        mtimes = [os.path.getmtime(self.outputPath(i)) for i in [1, 2]]
+
+        tape = self.createTape(resume=True)
+        tape.processTape()
+        self.assertTrue(tape.successFlag)
+
+        # Files 1 and 2 were not extracted again
+        self.assertEqual([os.path.getmtime(self.outputPath(i)) for i in [1, 2]], mtimes)
+        with open(self.outputPath(3), 'rb') as f:
+            self.assertEqual(f.read(), self.sourceData[2])
+        checksums = self.readChecksums()
+        for i, data in enumerate(self.sourceData):
+            fName = os.path.basename(self.outputPath(i + 1))
+            self.assertEqual(checksums[fName], hashlib.sha512(data).hexdigest())
+        metadata = self.readMetadata()
+        self.assertTrue(metadata['resumed'])
+        # Metrics of files 1 and 2 come from the journal
+        self.assertEqual([metrics['file'] for metrics in metadata['fileMetrics']], [1, 2, 3])
+        self.assertEqual([metrics['bytesRead'] for metrics in metadata['fileMetrics']],
+                         [len(data) for data in self.sourceData])
+
+    def testResumeWithOtherSettings(self):
+        tape = self.createTape()
+        tape.processTape()
+        tape = self.createTape(resume=True, compression='gzip')
+        tape.processTape()
+        self.assertFalse(tape.successFlag)
+        self.assertFalse(os.path.exists(self.outputPath(1) + '.gz'))
+
+
+if __name__ == '__main__':
+    unittest.main()